@@ -0,0 +1,161 @@
+"""
+Run the migration scripts end to end against the local fake CxOne server and report their throughput.
+
+    python benchmark.py --projects 200 --results-per-scan 2000 --latency-ms 20 -- --migration_workers 8
+
+Every script runs as its own process in a fresh working directory, in migration order, so the MT scripts see the
+snapshot and results.db of the ST scripts. Arguments after "--" are passed to every script. The report holds the wall
+time, API calls, SAST results per second, peak RSS and the SQLite write rate of every script, and is also written to
+benchmark.json in the working directory.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import List
+
+from fake_cxone_server import add_data_arguments, create_server
+
+import logging
+
+logger = logging.getLogger("main")
+
+scripts = [
+    ("st_group_project_application.py", "coupangst"),
+    ("mt_group_project_application.py", "coupangmst"),
+    ("st_results.py", "coupangst"),
+    ("mt_results.py", "coupangmst"),
+]
+repository_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_stats(server_url: str) -> dict:
+    with urllib.request.urlopen(f"{server_url}/_stats") as response:
+        return json.loads(response.read())
+
+
+def count_result_rows(db_file: str) -> int:
+    if not os.path.exists(db_file):
+        return 0
+    with sqlite3.connect(db_file) as connection:
+        try:
+            return connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+
+
+def run_script(script: str, tenant_name: str, server_url: str, work_dir: str, extra_arguments: List[str]) -> dict:
+    """
+    Run one script as a child process and measure it.
+
+    Returns:
+        dict: exit code, seconds and peak RSS of the child process
+    """
+    command = [
+        sys.executable, os.path.join(repository_dir, script),
+        "--cxone_access_control_url", server_url,
+        "--cxone_server", server_url,
+        "--cxone_tenant_name", tenant_name,
+        "--cxone_grant_type", "refresh_token",
+        "--cxone_refresh_token", "benchmark",
+        # keep the tokens of the fake server out of the token cache of the user
+        "--migration_token_cache_file", os.path.join(work_dir, "token_cache.json"),
+        *extra_arguments,
+    ]
+    environment = dict(os.environ, PYTHONPATH=repository_dir, checkmarx_config_path=os.devnull)
+    log_file_name = os.path.join(work_dir, f"{os.path.splitext(script)[0]}.log")
+    with open(log_file_name, "w") as log_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=work_dir, env=environment, stdout=log_file, stderr=subprocess.STDOUT)
+        _, status, resource_usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "exit_code": process.returncode,
+        "seconds": seconds,
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_mb": resource_usage.ru_maxrss / 1024,
+        "log": log_file_name,
+    }
+
+
+def run_benchmark(arguments, extra_arguments: List[str]) -> List[dict]:
+    fake_server = create_server(arguments)
+    threading.Thread(target=fake_server.serve_forever, daemon=True).start()
+    work_dir = arguments.work_dir or tempfile.mkdtemp(prefix="cx_one_st_to_mt_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    logger.info(f"fake CxOne server on {fake_server.url}, working directory {work_dir}")
+    reports = []
+    try:
+        for script, tenant_name in scripts:
+            if arguments.scripts and script not in arguments.scripts:
+                continue
+            stats_before = get_stats(fake_server.url)
+            rows_before = count_result_rows(os.path.join(work_dir, "results.db"))
+            report = run_script(script, tenant_name, fake_server.url, work_dir, extra_arguments)
+            stats_after = get_stats(fake_server.url)
+            rows_written = count_result_rows(os.path.join(work_dir, "results.db")) - rows_before
+            results_served = stats_after.get("results_served") - stats_before.get("results_served")
+            seconds = report.get("seconds")
+            report.update({
+                "script": script,
+                "api_calls": stats_after.get("total_requests") - stats_before.get("total_requests"),
+                "results_served": results_served,
+                "results_per_second": results_served / seconds if seconds else 0,
+                "predicates_sent": stats_after.get("predicates_received") - stats_before.get("predicates_received"),
+                "sqlite_rows_written": rows_written,
+                "sqlite_rows_per_second": rows_written / seconds if seconds else 0,
+                "requests": {
+                    route: count - stats_before.get("requests").get(route, 0)
+                    for route, count in stats_after.get("requests").items()
+                    if count != stats_before.get("requests").get(route, 0)
+                },
+            })
+            reports.append(report)
+            logger.info(
+                f"{script}: exit code {report.get('exit_code')}, {seconds:.2f}s, {report.get('api_calls')} API calls, "
+                f"{report.get('results_per_second'):.0f} results/s, {report.get('sqlite_rows_per_second'):.0f} rows/s, "
+                f"peak RSS {report.get('peak_rss_mb'):.1f} MB"
+            )
+    finally:
+        fake_server.shutdown()
+        fake_server.server_close()
+    with open(os.path.join(work_dir, "benchmark.json"), "w") as file:
+        json.dump(
+            {"arguments": vars(arguments), "extra_arguments": extra_arguments, "reports": reports}, file, indent=2
+        )
+    return reports
+
+
+def print_report(reports: List[dict]):
+    header = (
+        f"{'script':<34} {'exit':>4} {'seconds':>8} {'API calls':>9} {'results/s':>10} {'rows/s':>10} {'RSS MB':>7}"
+    )
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        print(
+            f"{report.get('script'):<34} {report.get('exit_code'):>4} {report.get('seconds'):>8.2f} "
+            f"{report.get('api_calls'):>9} {report.get('results_per_second'):>10.0f} "
+            f"{report.get('sqlite_rows_per_second'):>10.0f} {report.get('peak_rss_mb'):>7.1f}"
+        )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    argument_parser = argparse.ArgumentParser(description="benchmark the migration scripts against a fake CxOne")
+    add_data_arguments(argument_parser)
+    argument_parser.add_argument("--work-dir", default=None, help="defaults to a new temporary directory")
+    argument_parser.add_argument("--scripts", nargs="*", default=None, help="subset of the scripts to run, in order")
+    command_line = sys.argv[1:]
+    separator = command_line.index("--") if "--" in command_line else len(command_line)
+    benchmark_arguments = argument_parser.parse_args(command_line[:separator])
+    benchmark_reports = run_benchmark(benchmark_arguments, command_line[separator + 1:])
+    print_report(benchmark_reports)
+    sys.exit(max([report.get("exit_code") for report in benchmark_reports] or [0]) and 1)
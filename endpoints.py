@@ -0,0 +1,24 @@
+import re
+from urllib.parse import urlparse
+
+__all__ = ["endpoint_classes", "get_endpoint_class"]
+
+# endpoint class -> path pattern, every other call is in class "other". The rate limits are set per class and the
+# response cache keeps its entries per class.
+endpoint_classes = {
+    "token": re.compile(r"/protocol/openid-connect/token/?$"),
+    "predicates": re.compile(r"^/api/sast-results-predicates"),
+    "sast-results": re.compile(r"^/api/sast-results/?$"),
+    "scans": re.compile(r"^/api/scans"),
+    "projects": re.compile(r"^/api/(projects|configuration)"),
+    "applications": re.compile(r"^/api/applications"),
+    "groups": re.compile(r"^/auth(/admin)?/realms/[^/]+/(pip/)?groups"),
+}
+
+
+def get_endpoint_class(url: str) -> str:
+    path = urlparse(url).path
+    for endpoint_class, pattern in endpoint_classes.items():
+        if pattern.search(path):
+            return endpoint_class
+    return "other"
@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List
+
+import logging
+
+logger = logging.getLogger("main")
+time_stamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+__all__ = ["FailureJournal", "read_failures"]
+
+
+class FailureJournal:
+    """
+    Dead letter journal of the groups, projects and applications that could not be created, one JSON object per line.
+
+    The file is opened once in append mode and every record is flushed as a whole line under a lock, so concurrent
+    workers never interleave and a crash loses at most the record being written. A record holds the entity type and
+    name, the full ST payload needed to process the entity again, the error class and message, and the attempt.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.file = open(file_name, "a", encoding="utf-8")
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, entity_type: str, name: str, payload: dict, error: BaseException = None, attempt: int = 1,
+               entity_id: str = None):
+        record = {
+            "entity_type": entity_type,
+            "name": name,
+            "entity_id": entity_id,
+            "payload": payload,
+            "error_class": type(error).__name__ if error is not None else None,
+            "error": str(error) if error is not None else None,
+            "attempt": attempt,
+            "failed_at": datetime.now(timezone.utc).strftime(time_stamp_format),
+        }
+        self.write(record)
+        logger.error(f"{entity_type} {name} failed on attempt {attempt}: {record.get('error_class')}, "
+                     f"recorded in {self.file_name}")
+
+    def write(self, record: dict):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_failures(file_name: str) -> List[dict]:
+    """
+    Read a failure journal, the last record of every (entity_type, name) wins.
+
+    Returns:
+        List[dict]: records in the order of their first failure
+    """
+    records = OrderedDict()
+    if not os.path.exists(file_name):
+        return []
+    with open(file_name, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut off by a crash
+                continue
+            records[(record.get("entity_type"), record.get("name"))] = record
+    return list(records.values())
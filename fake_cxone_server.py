@@ -0,0 +1,547 @@
+"""
+Local stand-in for the CxOne endpoints used by the migration scripts, for benchmarks without a live tenant.
+
+Every tenant sees the same synthetic projects, scans and SAST results, so the ST and the MT side of a migration match.
+Groups and applications only exist in the seeded tenants (the ST side), other tenants start empty and accept creates.
+SAST results of a seeded tenant carry a mix of triage states, results of other tenants stay TO_VERIFY until a predicate
+changes them.
+
+    python fake_cxone_server.py --port 8080 --projects 200 --results-per-scan 2000 --latency-ms 20
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["FakeTenantData", "FakeCxOneServer"]
+
+branch_names = ["master", "main", "release", "rc", "develop", "stage"]
+severities = ["HIGH", "MEDIUM", "LOW", "INFO"]
+states = ["TO_VERIFY", "NOT_EXPLOITABLE", "PROPOSED_NOT_EXPLOITABLE", "CONFIRMED", "URGENT"]
+created_at = "2024-01-01T00:00:00.000000Z"
+
+
+class FakeTenantData:
+    """
+    Synthetic tenant content, generated from the sizes on demand instead of being held in memory.
+    """
+
+    def __init__(
+            self,
+            projects: int = 50,
+            branches_per_project: int = 2,
+            results_per_scan: int = 500,
+            groups: int = 20,
+            applications: int = 10,
+            seeded_tenants: List[str] = None,
+    ):
+        self.project_count = projects
+        self.branches_per_project = min(branches_per_project, len(branch_names))
+        self.results_per_scan = results_per_scan
+        self.group_count = groups
+        self.application_count = applications
+        self.seeded_tenants = seeded_tenants or ["coupangst"]
+        self.lock = threading.Lock()
+        self.tenants = {}
+
+    def get_tenant(self, tenant_name: str) -> dict:
+        with self.lock:
+            tenant = self.tenants.get(tenant_name)
+            if tenant is None:
+                seeded = tenant_name in self.seeded_tenants
+                tenant = {
+                    "seeded": seeded,
+                    "projects": {project.get("id"): project for project in self.generate_projects(seeded)},
+                    "groups": self.generate_groups() if seeded else {},
+                    "applications": self.generate_applications() if seeded else [],
+                    "predicates": {},
+                }
+                self.tenants[tenant_name] = tenant
+            return tenant
+
+    def generate_groups(self) -> Dict[str, dict]:
+        groups = {}
+        root_count = max(1, self.group_count // 4)
+        for index in range(self.group_count):
+            parent_id = None if index < root_count else f"group-{(index - root_count) // 3}"
+            name = f"group-{index:05d}"
+            path = f"{groups[parent_id].get('path')}/{name}" if parent_id else f"/{name}"
+            groups[f"group-{index}"] = {"id": f"group-{index}", "name": name, "path": path, "parentId": parent_id}
+        return groups
+
+    def generate_projects(self, seeded: bool) -> List[dict]:
+        return [
+            {
+                "id": f"project-{index}",
+                "name": f"project-{index:05d}",
+                "groups": [f"group-{index % self.group_count}"] if seeded and self.group_count else [],
+                "repoUrl": f"https://git.example.com/project-{index:05d}.git",
+                "mainBranch": branch_names[0],
+                "origin": "benchmark",
+                "createdAt": created_at,
+                "updatedAt": created_at,
+                "tags": {},
+                "criticality": 3,
+            } for index in range(self.project_count)
+        ]
+
+    def generate_applications(self) -> List[dict]:
+        return [
+            {
+                "id": f"application-{index}",
+                "name": f"application-{index:05d}",
+                "description": "",
+                "criticality": 3,
+                "rules": [{"id": f"rule-{index}", "type": "project.name.in", "value": f"project-{index:05d}"}],
+                "projectIds": [],
+                "createdAt": created_at,
+                "updatedAt": created_at,
+                "tags": {},
+            } for index in range(self.application_count)
+        ]
+
+    def get_scans(self, tenant: dict) -> List[dict]:
+        scans = []
+        for project in tenant.get("projects").values():
+            for branch in branch_names[:self.branches_per_project]:
+                scans.append({
+                    "id": f"scan-{project.get('id')}-{branch}",
+                    "status": "Completed",
+                    "projectId": project.get("id"),
+                    "projectName": project.get("name"),
+                    "branch": branch,
+                    "createdAt": created_at,
+                    "updatedAt": created_at,
+                })
+        return scans
+
+    @staticmethod
+    def get_similarity_id(scan_id: str, index: int) -> int:
+        return zlib.crc32(f"{scan_id}/{index}".encode("utf-8")) - 2 ** 31
+
+    def get_result_state(self, tenant: dict, project_id: str, scan_id: str, index: int):
+        predicate = tenant.get("predicates").get((project_id, str(self.get_similarity_id(scan_id, index))))
+        if predicate is not None:
+            return predicate
+        state = states[index % len(states)] if tenant.get("seeded") else states[0]
+        return state, severities[index % len(severities)]
+
+    def get_sast_result(self, tenant: dict, project_id: str, scan_id: str, index: int, include_nodes: bool) -> dict:
+        state, severity = self.get_result_state(tenant, project_id, scan_id, index)
+        query_index = index % 50
+        result = {
+            "resultHash": f"{scan_id}-{index}",
+            "queryID": query_index,
+            "queryName": f"Query_{query_index}",
+            "languageName": "Java",
+            "group": "Java_High_Risk",
+            "cweID": 79,
+            "severity": severity,
+            "similarityID": self.get_similarity_id(scan_id, index),
+            "confidenceLevel": 0,
+            "firstScanID": scan_id,
+            "firstFoundAt": created_at,
+            "status": "RECURRENT",
+            "foundAt": created_at,
+            "state": state,
+            "changeDetails": {"engineVersionChanged": False, "queryChanged": False, "codeChanged": False},
+        }
+        if include_nodes:
+            result["nodes"] = [
+                {
+                    "column": 5,
+                    "fileName": f"/src/main/java/File{index % 200}.java",
+                    "fullName": f"com.example.File{index % 200}.{node}",
+                    "length": 10,
+                    "line": 10 + index % 300,
+                    "methodLine": 1,
+                    "method": "handle",
+                    "name": node,
+                    "domType": "MethodInvokeExpr",
+                } for node in ["source", "sink"]
+            ]
+        return result
+
+
+def get_param(query: dict, name: str, default=None) -> Optional[str]:
+    values = query.get(name)
+    return values[0] if values else default
+
+
+def get_list_param(query: dict, name: str) -> List[str]:
+    values = []
+    for value in query.get(name) or []:
+        values.extend(item for item in value.split(",") if item)
+    return values
+
+
+class FakeCxOneHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if not body:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            return parse_qs(body.decode("utf-8"))
+
+    def send_json(self, status: int, payload=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats.record_bytes(len(body))
+
+    def get_tenant_from_token(self) -> str:
+        return (self.headers.get("Authorization") or "").split(" ")[-1]
+
+    def handle_request(self, method: str):
+        server = self.server
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        query = parse_qs(url.query)
+        body = self.read_body() if method != "GET" else None
+        if path != "/_stats" and server.latency:
+            time.sleep(server.latency)
+        if path.startswith("/api/") and server.throttle_rate and random.random() < server.throttle_rate:
+            server.stats.record(method, "throttled")
+            self.send_json(429, {"message": "too many requests"})
+            return
+        parts = path.strip("/").split("/")
+        try:
+            route = server.route(self, method, path, parts, query, body)
+        except Exception as e:
+            logger.exception(f"fake server failed on {method} {self.path}")
+            server.stats.record(method, "error")
+            self.send_json(500, {"message": repr(e)})
+            return
+        server.stats.record(method, route)
+
+
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.results_served = 0
+        self.predicates_received = 0
+        self.bytes_sent = 0
+
+    def record(self, method: str, route: str):
+        with self.lock:
+            self.requests[f"{method} {route}"] += 1
+
+    def record_bytes(self, size: int):
+        with self.lock:
+            self.bytes_sent += size
+
+    def add_results(self, count: int):
+        with self.lock:
+            self.results_served += count
+
+    def add_predicates(self, count: int):
+        with self.lock:
+            self.predicates_received += count
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "total_requests": sum(self.requests.values()),
+                "results_served": self.results_served,
+                "predicates_received": self.predicates_received,
+                "bytes_sent": self.bytes_sent,
+            }
+
+
+class FakeCxOneServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering the CxOne API calls of the migration scripts from a FakeTenantData.
+
+    Args:
+        address (tuple): (host, port), port 0 picks a free port
+        data (FakeTenantData):
+        latency_ms (int): delay added to every request
+        max_page_size (int): upper bound of the limit of paged endpoints, like the server side cap of CxOne
+        throttle_rate (float): share of the /api requests answered with 429 Too Many Requests
+    """
+    daemon_threads = True
+
+    def __init__(
+            self, address, data: FakeTenantData, latency_ms: int = 0, max_page_size: int = 1000,
+            throttle_rate: float = 0.0,
+    ):
+        super().__init__(address, FakeCxOneHandler)
+        self.data = data
+        self.latency = latency_ms / 1000
+        self.max_page_size = max_page_size
+        self.throttle_rate = throttle_rate
+        self.stats = Stats()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def get_page(self, query: dict):
+        offset = int(get_param(query, "offset", 0))
+        limit = min(int(get_param(query, "limit", 20)), self.max_page_size)
+        return offset, limit
+
+    def route(self, handler: FakeCxOneHandler, method: str, path: str, parts: List[str], query: dict, body) -> str:
+        """
+        Answer one request.
+
+        Returns:
+            str: route name counted in the stats
+        """
+        if path == "/_stats":
+            handler.send_json(200, self.stats.to_dict())
+            return "/_stats"
+        if parts[:2] == ["auth", "realms"] and parts[-1] == "token":
+            # the realm is the token, so the /api endpoints know which tenant is calling
+            handler.send_json(200, {"access_token": parts[2], "token_type": "Bearer", "expires_in": 3600})
+            return "/auth/realms/{realm}/protocol/openid-connect/token"
+        if parts[:2] == ["auth", "realms"] and parts[3:] == ["pip", "groups"]:
+            return self.pip_groups(handler, parts[2], query)
+        if parts[:3] == ["auth", "admin", "realms"] and parts[4:5] == ["groups"]:
+            return self.keycloak_groups(handler, method, parts[3], parts[5:], query, body)
+        tenant = self.data.get_tenant(handler.get_tenant_from_token())
+        if path == "/api/projects" and method == "GET":
+            return self.list_projects(handler, tenant, query)
+        if path == "/api/projects" and method == "POST":
+            return self.create_project(handler, tenant, body)
+        if path == "/api/projects/branches":
+            return self.list_branches(handler, tenant, query)
+        if path == "/api/scans":
+            return self.list_scans(handler, tenant, query)
+        if path == "/api/sast-results":
+            return self.list_sast_results(handler, tenant, query)
+        if path == "/api/sast-results-predicates" and method == "POST":
+            return self.add_predicates(handler, tenant, body)
+        if path == "/api/applications" and method == "GET":
+            return self.list_applications(handler, tenant, query)
+        if path == "/api/applications" and method == "POST":
+            return self.create_application(handler, tenant, body)
+        if path == "/api/configuration/project" and method == "PATCH":
+            handler.send_json(204)
+            return "/api/configuration/project"
+        handler.send_json(404, {"message": f"{method} {path} is not implemented by the fake server"})
+        return "not found"
+
+    def pip_groups(self, handler, realm: str, query: dict):
+        groups = self.data.get_tenant(realm).get("groups")
+        group_name = get_param(query, "groupName")
+        ids = get_list_param(query, "ids")
+        with self.lock:
+            items = [
+                {"id": group.get("id"), "name": group.get("path").lstrip("/")}
+                for group in groups.values()
+                if (not ids or group.get("id") in ids)
+                and (not group_name or group_name in group.get("path").lstrip("/"))
+            ]
+        handler.send_json(200, items)
+        return "/auth/realms/{realm}/pip/groups"
+
+    def keycloak_groups(self, handler, method: str, realm: str, rest: List[str], query: dict, body):
+        groups = self.data.get_tenant(realm).get("groups")
+        if method == "GET" and not rest:
+            first = int(get_param(query, "first", 0))
+            max_result_size = int(get_param(query, "max", 100))
+            with self.lock:
+                roots = [group for group in groups.values() if group.get("parentId") is None]
+                items = [self.to_keycloak_group(groups, group) for group in roots[first:first + max_result_size]]
+            handler.send_json(200, items)
+            return "/auth/admin/realms/{realm}/groups"
+        if method == "POST" and (not rest or rest[1:] == ["children"]):
+            parent_id = rest[0] if rest else None
+            with self.lock:
+                parent_path = groups[parent_id].get("path") if parent_id else ""
+                group_id = f"group-created-{len(groups)}"
+                name = body.get("name")
+                groups[group_id] = {
+                    "id": group_id, "name": name, "path": f"{parent_path}/{name}", "parentId": parent_id
+                }
+            handler.send_json(201)
+            return "/auth/admin/realms/{realm}/groups/{id}/children" if rest else "/auth/admin/realms/{realm}/groups"
+        handler.send_json(404)
+        return "not found"
+
+    def to_keycloak_group(self, groups: dict, group: dict) -> dict:
+        return {
+            "id": group.get("id"),
+            "name": group.get("name"),
+            "path": group.get("path"),
+            "subGroups": [
+                self.to_keycloak_group(groups, child)
+                for child in groups.values() if child.get("parentId") == group.get("id")
+            ],
+        }
+
+    def list_projects(self, handler, tenant: dict, query: dict):
+        offset, limit = self.get_page(query)
+        with self.lock:
+            projects = list(tenant.get("projects").values())
+        handler.send_json(200, {
+            "totalCount": len(projects),
+            "filteredTotalCount": len(projects),
+            "projects": projects[offset:offset + limit],
+        })
+        return "/api/projects"
+
+    def create_project(self, handler, tenant: dict, body: dict):
+        with self.lock:
+            projects = tenant.get("projects")
+            project = dict(body, id=f"project-created-{len(projects)}", createdAt=created_at, updatedAt=created_at)
+            projects[project.get("id")] = project
+        handler.send_json(201, project)
+        return "/api/projects"
+
+    def list_branches(self, handler, tenant: dict, query: dict):
+        offset, limit = self.get_page(query)
+        project_id = get_param(query, "project-id")
+        branches = sorted({
+            scan.get("branch") for scan in self.data.get_scans(tenant)
+            if project_id is None or scan.get("projectId") == project_id
+        })
+        handler.send_json(200, branches[offset:offset + limit])
+        return "/api/projects/branches"
+
+    def list_scans(self, handler, tenant: dict, query: dict):
+        offset, limit = self.get_page(query)
+        branches = get_list_param(query, "branches") + get_list_param(query, "branch")
+        project_id = get_param(query, "project-id")
+        scans = self.data.get_scans(tenant)
+        filtered_scans = [
+            scan for scan in scans
+            if (not branches or scan.get("branch") in branches)
+            and (project_id is None or scan.get("projectId") == project_id)
+        ]
+        handler.send_json(200, {
+            "totalCount": len(scans),
+            "filteredTotalCount": len(filtered_scans),
+            "scans": filtered_scans[offset:offset + limit],
+        })
+        return "/api/scans"
+
+    def list_sast_results(self, handler, tenant: dict, query: dict):
+        offset, limit = self.get_page(query)
+        scan_id = get_param(query, "scan-id")
+        project_id = scan_id[len("scan-"):].rsplit("-", 1)[0]
+        state_filter = get_list_param(query, "state")
+        severity_filter = get_list_param(query, "severity")
+        include_nodes = (get_param(query, "include-nodes", "true") or "true").lower() == "true"
+        indexes = range(self.data.results_per_scan)
+        if state_filter or severity_filter:
+            indexes = [
+                index for index in indexes
+                if self.matches(tenant, project_id, scan_id, index, state_filter, severity_filter)
+            ]
+        page_indexes = indexes[offset:offset + limit]
+        results = [
+            self.data.get_sast_result(tenant, project_id, scan_id, index, include_nodes) for index in page_indexes
+        ]
+        self.stats.add_results(len(results))
+        handler.send_json(200, {"results": results, "totalCount": len(indexes)})
+        return "/api/sast-results"
+
+    def matches(self, tenant, project_id, scan_id, index, state_filter, severity_filter) -> bool:
+        state, severity = self.data.get_result_state(tenant, project_id, scan_id, index)
+        return (not state_filter or state in state_filter) and (not severity_filter or severity in severity_filter)
+
+    def add_predicates(self, handler, tenant: dict, body: List[dict]):
+        with self.lock:
+            for predicate in body or []:
+                tenant.get("predicates")[(predicate.get("projectId"), str(predicate.get("similarityId")))] = (
+                    predicate.get("state"), predicate.get("severity")
+                )
+        self.stats.add_predicates(len(body or []))
+        handler.send_json(201)
+        return "/api/sast-results-predicates"
+
+    def list_applications(self, handler, tenant: dict, query: dict):
+        offset, limit = self.get_page(query)
+        with self.lock:
+            applications = list(tenant.get("applications"))
+        handler.send_json(200, {
+            "totalCount": len(applications),
+            "filteredTotalCount": len(applications),
+            "applications": applications[offset:offset + limit],
+        })
+        return "/api/applications"
+
+    def create_application(self, handler, tenant: dict, body: dict):
+        with self.lock:
+            applications = tenant.get("applications")
+            application = dict(
+                body, id=f"application-created-{len(applications)}", createdAt=created_at, updatedAt=created_at,
+                rules=[dict(rule, id=f"rule-created-{index}") for index, rule in enumerate(body.get("rules") or [])],
+            )
+            applications.append(application)
+        handler.send_json(201, application)
+        return "/api/applications"
+
+
+def add_data_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--branches-per-project", type=int, default=2)
+    parser.add_argument("--results-per-scan", type=int, default=500)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--applications", type=int, default=10)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--max-page-size", type=int, default=1000)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of API requests answered with 429")
+
+
+def create_server(arguments, host: str = "127.0.0.1", port: int = 0) -> FakeCxOneServer:
+    data = FakeTenantData(
+        projects=arguments.projects,
+        branches_per_project=arguments.branches_per_project,
+        results_per_scan=arguments.results_per_scan,
+        groups=arguments.groups,
+        applications=arguments.applications,
+    )
+    return FakeCxOneServer(
+        (host, port), data, latency_ms=arguments.latency_ms, max_page_size=arguments.max_page_size,
+        throttle_rate=arguments.throttle_rate,
+    )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    argument_parser = argparse.ArgumentParser(description="fake CxOne server for migration benchmarks")
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, default=8080)
+    add_data_arguments(argument_parser)
+    server_arguments = argument_parser.parse_args()
+    fake_server = create_server(server_arguments, host=server_arguments.host, port=server_arguments.port)
+    logger.info(f"fake CxOne server listening on {fake_server.url}")
+    fake_server.serve_forever()
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from requests.adapters import HTTPAdapter
+from CheckmarxPythonSDK.utilities import httpRequests
+from CheckmarxPythonSDK.utilities.compat import OK
+from metrics import install_metrics
+from migration_config import config
+from rate_control import install_rate_control
+from response_cache import ResponseCache, install_response_cache
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["TokenCache", "configure_http_client", "get_pool_size"]
+
+# a cached token is renewed this many seconds before it expires
+token_expiry_margin = 60
+
+
+def get_pool_size() -> int:
+    """
+    Connections kept alive per host: every worker can have page_workers or predicate_workers requests in flight.
+    """
+    pool_size = config.get("http_pool_size")
+    if pool_size:
+        return pool_size
+    return config.get("workers") * max(config.get("page_workers"), config.get("predicate_workers"), 1) + 4
+
+
+class TokenCache:
+    """
+    Access tokens shared by every script and process through one JSON file, keyed by a hash of the token url and the
+    token request, so the refresh token itself is never written. A token is used until token_expiry_margin seconds
+    before its expires_in. A token the SDK asks to renew, because the server rejected it, is never handed out again.
+    """
+
+    def __init__(self, cache_file: str):
+        self.cache_file = os.path.expanduser(cache_file)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(token_url: str, request_data: dict) -> str:
+        return hashlib.sha256(f"{token_url}\n{json.dumps(request_data, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+    def read(self) -> dict:
+        try:
+            with open(self.cache_file, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write(self, entries: dict):
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        file_descriptor = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(entries, file)
+        os.replace(temp_file, self.cache_file)
+
+    @staticmethod
+    def request_token(token_url, request_data, timeout=None, verify_ssl_cert=False, cert=None, proxies=None):
+        response = httpRequests.post(url=token_url, data=request_data, timeout=timeout, verify=verify_ssl_cert,
+                                     cert=cert, proxies=proxies)
+        if response.status_code != OK:
+            raise ValueError(response.text, response.status_code)
+        content = response.json()
+        token = content.get("token_type") + " " + content.get("access_token")
+        return token, int(content.get("expires_in") or 300)
+
+    def get_token(self, token_url, request_data, timeout=None, verify_ssl_cert=False, cert=None, proxies=None):
+        key = self.get_key(token_url, request_data)
+        rejected_token = httpRequests.auth_header.get("Authorization")
+        with self.lock:
+            entries = self.read()
+            entry = entries.get(key)
+            if entry and entry.get("token") != rejected_token and entry.get("expires_at", 0) > time.time():
+                return entry.get("token")
+            token, expires_in = self.request_token(
+                token_url, request_data, timeout=timeout, verify_ssl_cert=verify_ssl_cert, cert=cert, proxies=proxies
+            )
+            entries = {
+                cache_key: cache_entry for cache_key, cache_entry in self.read().items()
+                if cache_entry.get("expires_at", 0) > time.time()
+            }
+            entries[key] = {"token": token, "expires_at": time.time() + expires_in - token_expiry_margin}
+            self.write(entries)
+            logger.info(f"new access token cached in {self.cache_file}, expires in {expires_in}s")
+            return token
+
+
+def configure_http_client() -> Optional[ResponseCache]:
+    """
+    Configure the HTTP layer of the SDK once for every script: a keep-alive connection pool sized to the workers,
+    the cross process access token cache, the metrics, the rate control and the response cache. The rate control
+    does the retries instead of the connection pool, and the response cache is in front of it, so cache hits are
+    not rate limited.
+
+    Returns:
+        ResponseCache: None when the response cache is off
+    """
+    pool_size = get_pool_size()
+    for prefix in ["https://", "http://"]:
+        httpRequests.s.mount(prefix, HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+        ))
+    token_cache_file = config.get("token_cache_file")
+    if token_cache_file:
+        httpRequests.get_new_token = TokenCache(token_cache_file).get_token
+    logger.info(f"http connection pool size {pool_size}, token cache {token_cache_file or 'off'}")
+    install_metrics()
+    install_rate_control(max_concurrency=pool_size)
+    return install_response_cache()
@@ -0,0 +1,48 @@
+import glob
+import sys
+
+from migration_config import config
+from result_store import merge_results_dbs
+from sharding import get_shard_files
+
+import logging
+
+# create logger
+logger = logging.getLogger("main")
+logger.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+__all__ = ["logger"]
+
+# Merge the shard databases written by st_results.py on several machines into one results.db:
+#
+#     python merge_results.py --migration_shard_count 8
+#     python merge_results.py results.shard-*.db
+#
+# Without shard files on the command line, the shards of --migration_shard_count found next to results.db are merged.
+# A merged shard database is renamed to <shard>.merged, so a second merge does not apply its rows again.
+if __name__ == '__main__':
+    db_file = config.get("results_db")
+    patterns = []
+    arguments = iter(sys.argv[1:])
+    for argument in arguments:
+        if argument.startswith("--"):
+            # skip the value of --option value
+            if "=" not in argument:
+                next(arguments, None)
+            continue
+        patterns.append(argument)
+    if not patterns:
+        patterns = get_shard_files(db_file, config.get("shard_count"))
+    shard_db_files = [
+        file_name for pattern in patterns for file_name in sorted(glob.glob(pattern)) if file_name != db_file
+    ]
+    if not shard_db_files:
+        logger.error("no shard databases to merge")
+        sys.exit(1)
+    finding_count = merge_results_dbs(db_file, shard_db_files)
+    logger.info(f"merged {len(shard_db_files)} shards into {db_file}, {finding_count} findings")
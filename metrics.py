@@ -0,0 +1,189 @@
+import json
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict
+from urllib.parse import urlparse
+
+from CheckmarxPythonSDK.utilities import httpRequests
+from migration_config import config
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["metrics", "Metrics", "install_metrics", "write_metrics"]
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+id_pattern = re.compile(r"^([0-9a-fA-F]{8}-[0-9a-fA-F-]{27}|\d+)$")
+
+
+def get_endpoint(method: str, url: str) -> str:
+    """
+    "GET https://host/api/projects/<uuid>?x=1" -> "GET /api/projects/{id}", so calls of one endpoint are counted
+    together.
+    """
+    path = "/".join("{id}" if id_pattern.match(segment) else segment for segment in urlparse(url).path.split("/"))
+    return f"{method} {path.rstrip('/') or '/'}"
+
+
+class Series:
+    """
+    Count, total seconds, latency histogram, bytes, errors and retries of one endpoint or operation.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(latency_buckets) + 1)
+        self.bytes = 0
+        self.errors = 0
+        self.retries = 0
+
+    def observe(self, seconds: float, size: int = 0, error: bool = False):
+        self.count += 1
+        self.seconds += seconds
+        self.buckets[bisect_left(latency_buckets, seconds)] += 1
+        self.bytes += size
+        self.errors += int(error)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "seconds": round(self.seconds, 6),
+            "average_seconds": round(self.seconds / self.count, 6) if self.count else 0,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "retries": self.retries,
+            "histogram": {
+                str(bound): count for bound, count in zip(latency_buckets + ["+Inf"], self.buckets)
+            },
+        }
+
+
+class Metrics:
+    """
+    Thread safe registry of the HTTP calls and their retries (per endpoint) and the SQLite operations of a run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.series: Dict[str, Dict[str, Series]] = {"http": {}, "db": {}}
+
+    def get_series(self, kind: str, name: str) -> Series:
+        series = self.series[kind].get(name)
+        if series is None:
+            series = self.series[kind].setdefault(name, Series())
+        return series
+
+    def observe(self, kind: str, name: str, seconds: float, size: int = 0, error: bool = False):
+        with self.lock:
+            self.get_series(kind, name).observe(seconds, size=size, error=error)
+
+    def add_retry(self, kind: str, name: str):
+        with self.lock:
+            self.get_series(kind, name).retries += 1
+
+    @contextmanager
+    def timer(self, kind: str, name: str):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(kind, name, time.perf_counter() - start, error=error)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "seconds": round(time.monotonic() - self.started_at, 3),
+                **{
+                    kind: {name: series.to_dict() for name, series in sorted(named_series.items())}
+                    for kind, named_series in self.series.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        summary = self.to_dict()
+        for kind in ["http", "db"]:
+            metric = f"migration_{kind}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, series in summary.get(kind).items():
+                label = name.replace('"', '\\"')
+                cumulative = 0
+                for bound, count in series.get("histogram").items():
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{name="{label}"}} {series.get("seconds")}')
+                lines.append(f'{metric}_count{{name="{label}"}} {series.get("count")}')
+            lines.append(f"# TYPE migration_{kind}_errors_total counter")
+            for name, series in summary.get(kind).items():
+                lines.append(f'migration_{kind}_errors_total{{name="{name}"}} {series.get("errors")}')
+        lines.append("# TYPE migration_http_bytes_total counter")
+        for name, series in summary.get("http").items():
+            lines.append(f'migration_http_bytes_total{{name="{name}"}} {series.get("bytes")}')
+        lines.append("# TYPE migration_retries_total counter")
+        for name, series in summary.get("http").items():
+            lines.append(f'migration_retries_total{{name="{name}"}} {series.get("retries")}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        summary = self.to_dict()
+        parts = []
+        for kind in ["http", "db"]:
+            top = sorted(summary.get(kind).items(), key=lambda item: item[1].get("seconds"), reverse=True)[:5]
+            parts.extend(
+                f"{name}: {series.get('count')} calls, {series.get('seconds'):.1f}s, "
+                f"avg {series.get('average_seconds') * 1000:.0f}ms"
+                for name, series in top
+            )
+        retries = sum(series.get("retries") for kind in ["http", "db"] for series in summary.get(kind).values())
+        return f"run took {summary.get('seconds')}s, {retries} retries; " + "; ".join(parts)
+
+
+metrics = Metrics()
+
+
+def record_response(response, *args, **kwargs):
+    request = response.request
+    size = int(response.headers.get("Content-Length") or len(response.content or b""))
+    metrics.observe(
+        "http",
+        get_endpoint(request.method, request.url),
+        response.elapsed.total_seconds(),
+        size=size,
+        error=response.status_code >= 400,
+    )
+    return response
+
+
+def install_metrics():
+    """
+    Time every HTTP response of the SDK session, per endpoint.
+    """
+    if record_response not in httpRequests.s.hooks["response"]:
+        httpRequests.s.hooks["response"].append(record_response)
+
+
+def write_metrics(metrics_file: str = None):
+    """
+    Log the run summary and export all metrics, as Prometheus text if metrics_file ends with .prom, else as JSON.
+    """
+    metrics_file = metrics_file or config.get("metrics_file")
+    logger.info(metrics.summary())
+    if not metrics_file:
+        return
+    with open(metrics_file, "w") as file:
+        if metrics_file.endswith(".prom"):
+            file.write(metrics.to_prometheus())
+        else:
+            json.dump(metrics.to_dict(), file, indent=2)
+    logger.info(f"metrics written to {metrics_file}")
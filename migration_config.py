@@ -0,0 +1,54 @@
+from CheckmarxPythonSDK.utilities.configUtility import get_config
+
+__all__ = ["config"]
+
+# Options are read the same way as the --cxone_* options: section "Migration" of ~/.Checkmarx/config.ini,
+# environment variables "migration_<option>", or command line arguments "--migration_<option>".
+config_default = {
+    "branches": "master,main,release,rc,develop,stage",
+    "workers": 4,
+    "page_workers": 4,
+    "page_retries": 3,
+    "db_batch_size": 1000,
+    "results_db": "results.db",
+    "state_db": "migration_state.db",
+    "incremental": False,
+    "st_result_states": "",
+    "predicate_chunk_size": 500,
+    "predicate_workers": 2,
+    "predicate_retries": 3,
+    "predicate_delta": True,
+    "snapshot_dir": "snapshot",
+    "plan_file": "plan.json",
+    "plan_only": False,
+    "apply_plan": False,
+    "failure_file": "failure.jsonl",
+    "replay_failures": False,
+    "failure_max_attempts": 3,
+    "response_cache": "off",
+    "response_cache_dir": ".response_cache",
+    "response_cache_ttl": 3600,
+    "response_cache_max_mb": 1024,
+    "metrics_file": "metrics.json",
+    "http_pool_size": 0,
+    "token_cache_file": "~/.Checkmarx/cxone_token_cache.json",
+    "rate_limits": "",
+    "http_retries": 5,
+    "shard_count": 1,
+    "shard_index": -1,
+    "shard_units_file": "",
+}
+
+
+def convert_config_value(value, default):
+    if not isinstance(value, str):
+        return value
+    if isinstance(default, bool):
+        return value.lower() == "true"
+    if isinstance(default, int):
+        return int(value)
+    return value
+
+
+config = get_config(config_default=config_default, section="Migration", prefix="migration_")
+config = {key: convert_config_value(value, config_default.get(key)) for key, value in config.items()}
@@ -1,4 +1,6 @@
-import pickle
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from CheckmarxPythonSDK.CxOne.AccessControlAPI import (
     get_groups,
     get_group_by_name
@@ -7,12 +9,9 @@ from CheckmarxPythonSDK.CxOne.KeycloakAPI import (
     create_group,
     create_subgroup,
 )
-from typing import List
+from typing import List, Optional
 from CheckmarxPythonSDK.CxOne import (
-    get_a_list_of_applications,
     create_an_application,
-    get_all_projects,
-    get_a_list_of_projects,
     create_a_project,
     define_parameters_in_the_input_list_for_a_specific_project,
 )
@@ -23,6 +22,14 @@ from CheckmarxPythonSDK.CxOne.dto import (
     RuleInput,
 
 )
+from failure_journal import FailureJournal, read_failures
+from http_client import configure_http_client
+from metrics import write_metrics
+from migration_config import config
+from reconcile import build_plan, get_items_to_create, read_plan, write_plan
+from snapshot import read_section
+from tenant_catalog import ApplicationCatalog, ProjectCatalog
+from worker_pool import run_in_pool
 
 import logging
 
@@ -39,140 +46,207 @@ time_stamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
 __all__ = ["logger"]
 
 
-def get_or_create_groups(
-        group_full_name: str,
-        cxone_tenant_name: str
-) -> str:
-    group = get_group_by_name(realm=cxone_tenant_name, group_name=group_full_name)
-    if group:
-        group_id = group.id
-        logger.info(f"group {group_full_name} found. Its id is: {group_id}")
+class GroupTree:
+    """
+    Full group path -> group id of the MT tenant, read once with get_groups and updated in place after each create.
+    """
+
+    def __init__(self, cxone_tenant_name: str):
+        self.cxone_tenant_name = cxone_tenant_name
+        self.lock = threading.Lock()
+        self.group_ids = {group.name: group.id for group in get_groups(realm=cxone_tenant_name)}
+        self.errors = {}
+        logger.info(f"group tree loaded, {len(self.group_ids)} groups")
+
+    def get(self, group_full_name: str) -> Optional[str]:
+        with self.lock:
+            return self.group_ids.get(group_full_name)
+
+    def create(self, group_full_name: str) -> str:
+        """
+        Create one group, its parent has to exist already.
+        """
+        parent_path, _, group_name = group_full_name.rpartition("/")
+        if not parent_path:
+            logger.info(f"root group {group_name} not exist, start create root group")
+            create_group(realm=self.cxone_tenant_name, group_name=group_name)
+        else:
+            logger.info(f"current group: {group_full_name} does not exist, start create")
+            create_subgroup(realm=self.cxone_tenant_name, group_id=self.get(parent_path), subgroup_name=group_name)
+        group = get_group_by_name(realm=self.cxone_tenant_name, group_name=group_full_name)
+        with self.lock:
+            self.group_ids[group_full_name] = group.id
+        logger.info(f"group {group_full_name} created, id: {group.id}")
+        return group.id
+
+    def get_or_create(self, group_full_name: str) -> str:
+        group_names = group_full_name.split("/")
+        group_id = None
+        for index in range(len(group_names)):
+            group_path = "/".join(group_names[0: index + 1])
+            group_id = self.get(group_path) or self.create(group_path)
         return group_id
-    logger.info(f"group {group_full_name} not found. It contains sub groups.")
-    group_id = create_all_groups(cxone_tenant_name=cxone_tenant_name, group_full_name=group_full_name)
-    logger.info(f"group {group_full_name} created, id: {group_id}")
-    return group_id
-
-
-def create_all_groups(cxone_tenant_name, group_full_name) -> str:
-    group_names = group_full_name.split("/")
-    root_group_name = group_names[0]
-    root_group_id = create_root_group_if_not_exist(cxone_tenant_name, root_group_name)
-    if len(group_names) == 1:
-        return root_group_id
-    group_id = create_sub_groups(
-        cxone_tenant_name=cxone_tenant_name,
-        group_names=group_names,
-        root_group_id=root_group_id
-    )
-    return group_id
 
+    def create_all(self, group_full_names: List[str], workers: int):
+        """
+        Create every missing group and its missing parents. Groups of the same depth are independent of each other
+        and are created concurrently, a depth only starts once all parents of the previous depth exist.
+        """
+        missing_paths = set()
+        for group_full_name in group_full_names:
+            group_names = group_full_name.split("/")
+            for index in range(len(group_names)):
+                group_path = "/".join(group_names[0: index + 1])
+                if self.get(group_path) is None:
+                    missing_paths.add(group_path)
+        levels = {}
+        for group_path in missing_paths:
+            levels.setdefault(group_path.count("/"), []).append(group_path)
+        for depth in sorted(levels):
+            group_paths = [group_path for group_path in levels.get(depth)
+                           if depth == 0 or self.get(group_path.rpartition("/")[0]) is not None]
+            run_in_pool(
+                group_paths,
+                self._create_in_pool,
+                workers=workers,
+                description=f"create groups of depth {depth + 1}",
+            )
 
-def create_sub_groups(cxone_tenant_name, group_names, root_group_id) -> str:
-    parent_group_id = root_group_id
-    for index, group_name in enumerate(group_names):
-        if index == 0:
-            continue
-        group_path = "/".join(group_names[0: index + 1])
-        group = get_group_by_name(realm=cxone_tenant_name, group_name=group_path)
-        if not group:
-            logger.info(f"current group: {group_path} does not exist, start create")
-            create_subgroup(realm=cxone_tenant_name, group_id=parent_group_id, subgroup_name=group_name)
-            logger.info(f"finish create group: {group_path}")
-            group = get_group_by_name(realm=cxone_tenant_name, group_name=group_path)
-        parent_group_id = group.id
-    return parent_group_id
-
-
-def create_root_group_if_not_exist(cxone_tenant_name, root_group_name) -> str:
-    root_group = get_group_by_name(realm=cxone_tenant_name, group_name=root_group_name)
-    if root_group:
-        root_group_id = root_group.id
-        logger.info(f"root group {root_group_name} exist. id: {root_group_id}")
-    else:
-        logger.info(f"root group not exist, start create root group")
-        create_group(realm=cxone_tenant_name, group_name=root_group_name)
-        root_group = get_group_by_name(realm=cxone_tenant_name, group_name=root_group_name)
-        root_group_id = root_group.id
-        logger.info(f"root group {root_group_name} created. id: {root_group_id}")
-    return root_group_id
+    def get_error(self, group_full_name: str) -> Optional[Exception]:
+        """
+        Error that kept the group from being created, its own or the one of its closest failed parent.
+        """
+        group_path = group_full_name
+        with self.lock:
+            while group_path:
+                if group_path in self.errors:
+                    return self.errors.get(group_path)
+                group_path = group_path.rpartition("/")[0]
+        return None
+
+    def _create_in_pool(self, group_full_name: str) -> str:
+        try:
+            self.create(group_full_name)
+        except Exception as e:
+            with self.lock:
+                self.errors[group_full_name] = e
+            raise
+        return "created"
 
 
-def process_project(
+def create_project(
         project_data: dict,
-        groups_data: List[dict] = None,
-        sca_last_sast_scan_time: int = 2
-) -> str:
+        project_catalog: ProjectCatalog,
+) -> Optional[str]:
+    """
+    Create the project if the tenant snapshot does not have it yet.
+
+    Returns:
+        str: id of the new project, None if it already exists
+    """
     project_criticality = project_data.get("criticality")
-    project_groups = project_data.get("groups")
     project_main_branch = project_data.get("mainBranch")
     project_name = project_data.get("name")
     project_origin = project_data.get("origin")
     project_repo_url = project_data.get("repoUrl")
     project_tags = project_data.get("tags")
-    project_collection = get_a_list_of_projects(names=[project_name])
-    if not project_collection.projects:
-        logger.info("project does not exist. create project")
-        project = create_a_project(
-            project_input=ProjectInput(
-                name=project_name,
-                # groups=[
-                #     list(
-                #         filter(lambda r: r.get("name") == group_name, groups_data)
-                #     )[0].get("id") for group_name in project_groups
-                # ],
-                repo_url=project_repo_url,
-                main_branch=project_main_branch,
-                origin=project_origin,
-                tags=project_tags,
-                criticality=project_criticality
-            )
-        )
-        project_id = project.id
-        logger.info(f"new project name {project_name} with project_id: {project_id} created.")
-        logger.info(f"project id: {project_id}")
-        logger.info("start update project configuration")
-        scan_parameters = [
-            ScanParameter(
-                key="scan.config.sca.ExploitablePath",
-                name="exploitablePath",
-                category="sca",
-                origin_level="Project",
-                value="false",
-                value_type="Bool",
-                value_type_params=None,
-                allow_override=True
-            ),
-            ScanParameter(
-                key="scan.config.sca.LastSastScanTime",
-                name="lastSastScanTime",
-                category="sca",
-                origin_level="Project",
-                value=f"{sca_last_sast_scan_time}",
-                value_type="Number",
-                value_type_params=None,
-                allow_override=True
-            ),
-        ]
-        define_parameters_in_the_input_list_for_a_specific_project(
-            project_id=project_id,
-            scan_parameters=scan_parameters
+    if project_name in project_catalog:
+        return None
+    logger.info(f"project {project_name} does not exist. create project")
+    project = create_a_project(
+        project_input=ProjectInput(
+            name=project_name,
+            repo_url=project_repo_url,
+            main_branch=project_main_branch,
+            origin=project_origin,
+            tags=project_tags,
+            criticality=project_criticality
         )
-        logger.info("finish update project configuration")
-        return project_id
+    )
+    project_catalog.add(project)
+    logger.info(f"new project name {project_name} with project_id: {project.id} created.")
+    return project.id
+
+
+def define_project_parameters(project_id: str, sca_last_sast_scan_time: int = 2):
+    logger.info(f"project id: {project_id}, start update project configuration")
+    scan_parameters = [
+        ScanParameter(
+            key="scan.config.sca.ExploitablePath",
+            name="exploitablePath",
+            category="sca",
+            origin_level="Project",
+            value="false",
+            value_type="Bool",
+            value_type_params=None,
+            allow_override=True
+        ),
+        ScanParameter(
+            key="scan.config.sca.LastSastScanTime",
+            name="lastSastScanTime",
+            category="sca",
+            origin_level="Project",
+            value=f"{sca_last_sast_scan_time}",
+            value_type="Number",
+            value_type_params=None,
+            allow_override=True
+        ),
+    ]
+    define_parameters_in_the_input_list_for_a_specific_project(
+        project_id=project_id,
+        scan_parameters=scan_parameters
+    )
+    logger.info(f"project id: {project_id}, finish update project configuration")
+
+
+def process_projects(
+        projects: List[dict],
+        project_catalog: ProjectCatalog,
+        workers: int,
+        failure_journal: FailureJournal,
+        sca_last_sast_scan_time: int = 2
+):
+    """
+    Two stage pipeline: projects are created by a pool of workers, the parameters of each new project are defined by
+    a second pool as soon as its id comes back. A failure in either stage only fails its own project, and is recorded
+    in the failure journal.
+    """
+    parameter_futures = []
+
+    def create_and_define_parameters(project_data: dict) -> str:
+        project_name = project_data.get("name")
+        try:
+            project_id = create_project(project_data, project_catalog)
+        except Exception as e:
+            logger.exception(f"failed to create project {project_name}")
+            failure_journal.record("project", project_name, project_data, e)
+            return "failed"
+        if project_id is None:
+            return "exists"
+        parameter_futures.append((project_data, project_id, parameter_executor.submit(
+            define_project_parameters, project_id, sca_last_sast_scan_time=sca_last_sast_scan_time
+        )))
+        return "created"
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as parameter_executor:
+        run_in_pool(projects, create_and_define_parameters, workers=workers, description="create projects")
+    for project_data, project_id, future in parameter_futures:
+        if future.exception() is not None:
+            failure_journal.record(
+                "project_parameters", project_data.get("name"), project_data, future.exception(), entity_id=project_id
+            )
 
 
 def process_application(
         application_data: dict,
+        application_catalog: ApplicationCatalog,
 ) -> str:
     application_criticality = application_data.get("criticality")
     application_description = application_data.get("description")
     application_name = application_data.get("name")
     application_rules = application_data.get("rules")
     application_tags = application_data.get("tags")
-    application_collection = get_a_list_of_applications()
-    filtered_applications = list(filter(lambda r: r.name == application_name, application_collection.applications))
-    if not application_collection.applications or not filtered_applications:
+    if application_name not in application_catalog:
         logger.info("application does not exist. create application")
         application_input = ApplicationInput(
             name=application_name,
@@ -187,79 +261,148 @@ def process_application(
             tags=application_tags
         )
         application = create_an_application(application_input=application_input)
+        application_catalog.add(application)
         logger.info(f"new application name {application_name} with application_id: {application.id} created.")
 
         return application.id
 
 
-def process_groups_projects_applications(groups, projects, applications, cxone_tenant_name):
+def process_groups_projects_applications(
+        groups, projects, applications, group_tree, project_catalog, application_catalog, failure_journal
+):
+    group_tree.create_all([group.get("name") for group in groups], workers=config.get("workers"))
     for group in groups:
-        try:
-            group_id = get_or_create_groups(
-                group_full_name=group.get("name"),
-                cxone_tenant_name=cxone_tenant_name
-            )
-            group["id"] = group_id
-        except Exception:
-            group_name = group.get("name")
-            add_failed_message(f"group_name: {group_name}")
-            continue
-    for project in projects:
-        try:
-            process_project(
-                project_data=project,
-                # groups_data=groups,
-                sca_last_sast_scan_time=2
-            )
-        except Exception:
-            project_name = project.get("name")
-            add_failed_message(f"project_name: {project_name}")
+        group_name = group.get("name")
+        group_id = group_tree.get(group_name)
+        if group_id is None:
+            failure_journal.record("group", group_name, group, group_tree.get_error(group_name))
             continue
+        group["id"] = group_id
+    process_projects(
+        projects, project_catalog, workers=config.get("workers"), failure_journal=failure_journal,
+        sca_last_sast_scan_time=2,
+    )
     for application in applications:
         try:
-            process_application(application)
-        except Exception:
-            application_name = application.get("name")
-            add_failed_message(f"application_name: {application_name}")
+            process_application(application, application_catalog)
+        except Exception as e:
+            failure_journal.record("application", application.get("name"), application, e)
             continue
 
 
-def add_failed_message(message):
-    with open("failure.txt", "a") as file:
-        file.write(message)
+def replay_project_create(record: dict, project_catalog: ProjectCatalog) -> dict:
+    """
+    Create the project of a failed "project" record and return the "project_parameters" record that is left to do.
+    The parameters are defined again also when the project exists, the failed create may have reached the server.
+    """
+    project_id = create_project(record.get("payload"), project_catalog)
+    if project_id is None:
+        project_id = project_catalog.get(record.get("name")).id
+    return dict(record, entity_type="project_parameters", entity_id=project_id)
+
+
+def replay_failure(record: dict, group_tree, project_catalog, application_catalog):
+    entity_type = record.get("entity_type")
+    payload = record.get("payload")
+    if entity_type == "group":
+        group_tree.get_or_create(record.get("name"))
+    elif entity_type == "project_parameters":
+        project = project_catalog.get(record.get("name"))
+        define_project_parameters(record.get("entity_id") or project.id)
+    elif entity_type == "application":
+        process_application(payload, application_catalog)
+    else:
+        raise ValueError(f"unknown entity type {entity_type}")
+
+
+def replay_failures(failure_file: str, group_tree, project_catalog, application_catalog, max_attempts: int):
+    """
+    Process again only the entities of the failure journal, instead of the whole plan. Groups are replayed one by one
+    in path order, so parents come first, projects and applications by workers threads. An entity that failed
+    max_attempts times is kept in the journal but not tried again. The journal is then replaced by the entities that
+    still fail.
+    """
+    records = read_failures(failure_file)
+    logger.info(f"replay {len(records)} failures of {failure_file}")
+    replay_file = f"{failure_file}.replay"
+    if os.path.exists(replay_file):
+        # left over by an interrupted replay, the failure journal itself is only replaced at the end
+        os.remove(replay_file)
+
+    with FailureJournal(replay_file) as failure_journal:
+        def replay(record: dict) -> str:
+            attempt = record.get("attempt") or 1
+            if attempt >= max_attempts:
+                logger.warning(f"{record.get('entity_type')} {record.get('name')} failed {attempt} times, skip")
+                failure_journal.write(record)
+                return "given up"
+            try:
+                if record.get("entity_type") == "project":
+                    # like process_projects, a parameter failure of a created project is journaled as
+                    # project_parameters with the new project id
+                    record = replay_project_create(record, project_catalog)
+                replay_failure(record, group_tree, project_catalog, application_catalog)
+            except Exception as e:
+                failure_journal.record(
+                    record.get("entity_type"), record.get("name"), record.get("payload"), e, attempt=attempt + 1,
+                    entity_id=record.get("entity_id"),
+                )
+                return "failed"
+            return "replayed"
+
+        group_records = sorted(
+            (record for record in records if record.get("entity_type") == "group"), key=lambda r: r.get("name")
+        )
+        run_in_pool(group_records, replay, workers=1, description="replay groups")
+        run_in_pool(
+            [record for record in records if record.get("entity_type") != "group"],
+            replay,
+            workers=config.get("workers"),
+            description="replay projects and applications",
+        )
+    os.replace(replay_file, failure_file)
+    logger.info(f"{failure_journal.count} failures left in {failure_file}")
 
 
 if __name__ == '__main__':
-    with open('data.pkl', 'rb') as f:
-        data = pickle.load(f)
-    groups = data.get("groups")
-    projects = data.get("projects")
-    applications = data.get("applications")
+    response_cache = configure_http_client()
     cxone_tenant_name = "coupangmst"
-    groups_in_mt_tenant = get_groups(cxone_tenant_name)
-    groups_not_created = []
-    for group in groups:
-        group_name = group.get("name")
-        group_in_mt = list(filter(lambda r: r.name == group_name, groups_in_mt_tenant))
-        if not group_in_mt:
-            groups_not_created.append(group)
-    logger.info(f"groups_not_created: {groups_not_created}")
-    projects_not_created = []
-    projects_in_mt_tenant = get_all_projects()
-    for project in projects:
-        project_name = project.get("name")
-        project_in_mt = list(filter(lambda r: r.name == project_name, projects_in_mt_tenant))
-        if not project_in_mt:
-            projects_not_created.append(project)
-    logger.info(f"projects_not_created: {projects_not_created}")
-    applications_not_created = []
-    applications_in_mt_tenant = get_a_list_of_applications(limit=100).applications
-    for application in applications:
-        application_name = application.get("name")
-        application_in_mt = list(filter(lambda r: r.name == application_name, applications_in_mt_tenant))
-        if not application_in_mt:
-            applications_not_created.append(application)
-    logger.info(f"applications_not_created: {applications_not_created}")
-    process_groups_projects_applications(
-        groups_not_created, projects_not_created, applications_not_created, cxone_tenant_name
-    )
+    group_tree = GroupTree(cxone_tenant_name)
+    project_catalog = ProjectCatalog()
+    application_catalog = ApplicationCatalog()
+    plan_file = config.get("plan_file")
+    failure_file = config.get("failure_file")
+    if config.get("replay_failures"):
+        replay_failures(
+            failure_file, group_tree, project_catalog, application_catalog, config.get("failure_max_attempts")
+        )
+    else:
+        if config.get("apply_plan"):
+            plan = read_plan(plan_file)
+        else:
+            snapshot_dir = config.get("snapshot_dir")
+            plan = build_plan(
+                st_groups=read_section(snapshot_dir, "groups"),
+                st_projects=read_section(snapshot_dir, "projects"),
+                st_applications=read_section(snapshot_dir, "applications"),
+                mt_group_ids=group_tree.group_ids,
+                mt_projects=project_catalog.projects,
+                mt_applications=application_catalog.applications,
+            )
+            write_plan(plan, plan_file)
+        if config.get("plan_only"):
+            logger.info(f"plan only, review {plan_file} and apply it with --migration_apply_plan true")
+        else:
+            with FailureJournal(failure_file) as failure_journal:
+                process_groups_projects_applications(
+                    get_items_to_create(plan, "groups"),
+                    get_items_to_create(plan, "projects"),
+                    get_items_to_create(plan, "applications"),
+                    group_tree,
+                    project_catalog,
+                    application_catalog,
+                    failure_journal,
+                )
+    if response_cache:
+        logger.info(response_cache.summary())
+    write_metrics()
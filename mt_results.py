@@ -1,14 +1,21 @@
 import pickle
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import List
 from CheckmarxPythonSDK.CxOne import (
     get_all_projects,
-    get_branches,
-    get_a_list_of_scans,
-    get_sast_results_by_scan_id,
     predicate_severity_and_state_by_similarity_id_and_project_id,
 
 )
+from http_client import configure_http_client
+from metrics import write_metrics
+from migration_config import config
+from result_store import PredicateIndex, batched
+from retry_policy import call_with_retry
+from sast_result_fetcher import get_all_sast_result_by_scan_id
+from scan_discovery import ProjectBranch, get_project_branch_units
+from state_journal import StateJournal
+from worker_pool import run_in_pool
 
 import logging
 
@@ -22,55 +29,7 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 time_stamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
 
-
-def get_all_sast_result_by_scan_id(scan_id):
-    offset = 0
-    limit = 100
-    page = 1
-    sast_results_collection = get_sast_results_by_scan_id(
-        scan_id=scan_id, offset=offset, limit=limit,
-        sort=["+status", "+severity", "-queryname"]
-    )
-    total_count = int(sast_results_collection.get("totalCount"))
-    sast_results = sast_results_collection.get("results")
-    if total_count > limit:
-        while True:
-            offset = page * limit
-            if offset >= total_count:
-                break
-            sast_results_collection = get_sast_results_by_scan_id(
-                scan_id=scan_id, offset=offset, limit=limit,
-                sort=["+status", "+severity", "-queryname"]
-            )
-            page += 1
-            sast_results.extend(sast_results_collection.get("results"))
-    return sast_results
-
-
-def get_predicates_data_from_db(project_name: str, branch: str) -> dict:
-    result = {}
-    con = sqlite3.connect("results.db")
-    logger.info("get data from database")
-    sql_query = (f"SELECT project_name, branch, result_state, result_severity, comment, similarity_id FROM results "
-                 f"where project_name='{project_name}' and branch='{branch}';")
-    try:
-        with con:
-            for row in con.execute(sql_query):
-                result_state = row[2]
-                result_severity = row[3]
-                comment = row[4]
-                similarity_id = int(row[5])
-                result.update({
-                    similarity_id: {
-                        "result_state": result_state,
-                        "result_severity": result_severity,
-                        "comment": comment,
-                    }
-                })
-    except sqlite3.OperationalError:
-        logger.info(f"couldn't read predicates data for project: {project_name}, branch: {branch}")
-    con.close()
-    return result
+stage = "mt_results"
 
 
 pickle_file_name = "processed_project_branch.pickle"
@@ -85,27 +44,66 @@ def read_from_project_branch_pickle_file() -> dict:
         return {}
 
 
-def write_into_project_branch_pickle_file(project_name, branch):
+def import_project_branch_pickle_file(state_journal: StateJournal):
+    """
+    Move the resume state of older runs from processed_project_branch.pickle into the state journal.
+    """
+    if not state_journal.is_empty(stage):
+        return
     data = read_from_project_branch_pickle_file()
-    branches = data.get(project_name)
-    if not branches:
-        data.update({project_name: [branch]})
-    else:
-        data.update({project_name: branches.append(branch)})
-    with open(pickle_file_name, "wb") as f:
-        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
-
-
-def apply_predicates(scan_results, predicates_data: dict, project_id: str, scan_id: str):
+    project_branches = [
+        (project_name, branch) for project_name, branches in data.items() for branch in branches or []
+    ]
+    if project_branches:
+        imported = state_journal.import_done(stage, project_branches)
+        logger.info(f"imported {imported} project/branch pairs from {pickle_file_name} into the state journal")
+
+
+def submit_predicates(request_body: List[dict], description: str):
+    """
+    Send the predicates in chunks of predicate_chunk_size, predicate_workers chunks at a time.
+    Every chunk is retried on its own with exponential backoff.
+    """
+    chunks = list(batched(request_body, config.get("predicate_chunk_size")))
+    logger.info(f"{description}: submit {len(request_body)} predicates in {len(chunks)} chunks")
+    with ThreadPoolExecutor(max_workers=config.get("predicate_workers")) as executor:
+        futures = [
+            executor.submit(
+                call_with_retry,
+                predicate_severity_and_state_by_similarity_id_and_project_id,
+                request_body=chunk,
+                retries=config.get("predicate_retries"),
+                description=f"{description}: predicates chunk {index + 1}/{len(chunks)}",
+            ) for index, chunk in enumerate(chunks)
+        ]
+        for future in futures:
+            future.result()
+
+
+def apply_predicates(
+        scan_results, predicates_data: dict, project_id: str, scan_id: str, project_name: str, branch: str
+) -> int:
+    """
+    Send the ST triage of the scan results. With predicate_delta, results whose state and severity already match
+    the ST triage are not sent again.
+
+    Returns:
+        int: number of predicates sent
+    """
+    delta_only = config.get("predicate_delta")
     request_body: List[dict] = []
+    missing_count = 0
+    matched_count = 0
     for scan_result in scan_results:
-        similarity_id = scan_result.similarity_id
-        if similarity_id not in predicates_data.keys():
-            logger.info("similarity_id does not exist in predicates_data keys! skip!")
+        similarity_id = int(scan_result.similarity_id)
+        predicate = predicates_data.get(similarity_id)
+        if predicate is None:
+            missing_count += 1
+            continue
+        result_state, result_severity, comment = predicate
+        if delta_only and scan_result.state == result_state and scan_result.severity == result_severity:
+            matched_count += 1
             continue
-        result_severity = predicates_data.get(similarity_id).get("result_severity")
-        result_state = predicates_data.get(similarity_id).get("result_state")
-        comment = predicates_data.get(similarity_id).get("comment")
         request_body.append(
             {
                 "similarityId": str(similarity_id),
@@ -116,52 +114,60 @@ def apply_predicates(scan_results, predicates_data: dict, project_id: str, scan_
                 "comment": comment
             }
         )
-    logger.info(f"request_body: \n {request_body}")
-    predicate_severity_and_state_by_similarity_id_and_project_id(request_body=request_body)
+    logger.info(
+        f"project: {project_name}, branch: {branch}, matched: {matched_count}, changed: {len(request_body)}, "
+        f"missing: {missing_count}"
+    )
+    submit_predicates(request_body, description=f"project: {project_name}, branch: {branch}")
     logger.info(f"finish apply predicates to project: {project_name}, branch: {branch}")
-    write_into_project_branch_pickle_file(project_name, branch)
+    return len(request_body)
+
+
+def process_project_branch(unit: ProjectBranch, predicate_index: PredicateIndex, state_journal: StateJournal) -> str:
+    project_id, project_name, branch, scan_id = unit
+    if state_journal.is_done(stage, project_name, branch):
+        logger.info(f"project_name: {project_name}, branch: {branch} already processed! Skip!")
+        return "skipped"
+    # the preloaded ST triage is checked first, a branch without any is never downloaded
+    predicates_data = predicate_index.get(project_name=project_name, branch=branch)
+    if not predicates_data:
+        logger.info(f"project_name: {project_name}, branch: {branch}, predicates_data is empty, skip!")
+        return "no predicates"
+    logger.info(f"project_name: {project_name}, branch: {branch}, scan id: {scan_id}")
+    # only the similarity id, state and severity are compared, the nodes are never needed
+    scan_results = get_all_sast_result_by_scan_id(scan_id, include_nodes=False)
+    if not scan_results:
+        logger.info(f"project_name: {project_name}, branch: {branch}, No scan result, Skip!")
+        return "no result"
+    state_journal.mark_started(stage, project_name, branch, scan_id)
+    try:
+        predicate_count = apply_predicates(
+            scan_results=scan_results, predicates_data=predicates_data, project_id=project_id, scan_id=scan_id,
+            project_name=project_name, branch=branch,
+        )
+    except Exception:
+        logger.info(f"Can not apply predicates to project_id: {project_id}, scan_id: {scan_id}")
+        state_journal.mark_failed(stage, project_name, branch, scan_id)
+        raise
+    state_journal.mark_done(stage, project_name, branch, scan_id, predicate_count)
+    return "done"
 
 
 if __name__ == '__main__':
+    response_cache = configure_http_client()
     projects = get_all_projects()
-    project_branches_from_pickle = read_from_project_branch_pickle_file()
-    for project in projects:
-        project_id = project.id
-        project_name = project.name
-        if project_name in ["CxPSEMEA-Query Migration Project"]:
-            continue
-        branches_already_processed = project_branches_from_pickle.get(project_name) or []
-        branches = get_branches(limit=2048, project_id=project_id)
-        if not branches:
-            logger.info(f"project: {project_name} has no branches")
-            continue
-        for branch in branches:
-            if branch not in ["master", "main", "release", "rc", "develop", "stage"]:
-                continue
-            logger.info(f"project_name: {project_name}, branch: {branch}")
-            if branch in branches_already_processed:
-                logger.info(f"branch already processed! Skip!")
-                continue
-            logger.info("get last scan")
-            scans_collection = get_a_list_of_scans(limit=1, project_id=project_id, branch=branch, sort=["-created_at"])
-            if not scans_collection.scans:
-                logger.info("this project has no scan yet. Skip!")
-                continue
-            scan_id = scans_collection.scans[0].id
-            logger.info(f"scan id: {scan_id}")
-            scan_results = get_all_sast_result_by_scan_id(scan_id)
-            logger.info(f"get last scan result")
-            if not scan_results:
-                logger.info("No scan result, Skip!")
-                continue
-            predicates_data = get_predicates_data_from_db(project_name=project_name, branch=branch)
-            if not predicates_data:
-                logger.info("predicates_data is empty, skip!")
-                continue
-            try:
-                apply_predicates(
-                    scan_results=scan_results, predicates_data=predicates_data, project_id=project_id, scan_id=scan_id
-                )
-            except ValueError:
-                logger.info(f"Can not apply predicates to project_id: {project_id}, scan_id: {scan_id}")
-                continue
+    state_journal = StateJournal()
+    import_project_branch_pickle_file(state_journal)
+    predicate_index = PredicateIndex.load(config.get("results_db"))
+    workers = config.get("workers")
+    units = get_project_branch_units(projects)
+    run_in_pool(
+        units,
+        partial(process_project_branch, predicate_index=predicate_index, state_journal=state_journal),
+        workers=workers,
+        description=stage,
+    )
+    state_journal.close()
+    if response_cache:
+        logger.info(response_cache.summary())
+    write_metrics()
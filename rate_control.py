@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from requests.exceptions import ConnectionError, Timeout
+import retry_policy
+from CheckmarxPythonSDK.utilities import httpRequests
+from endpoints import get_endpoint_class
+from metrics import get_endpoint, metrics
+from migration_config import config
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["TokenBucket", "AdaptiveConcurrency", "RateController", "parse_rate_limits", "install_rate_control"]
+
+retry_status_codes = [429, 500, 502, 503, 504]
+# responses that mean the tenant is overloaded, the concurrency is halved
+throttle_status_codes = [429, 503]
+# a response slower than this many times the average latency of its endpoint class is a latency spike
+latency_spike_factor = 4.0
+latency_spike_min_seconds = 1.0
+# the concurrency is decreased at most once per this many seconds, so a burst of 429 counts once
+decrease_interval_seconds = 2.0
+backoff_base_seconds = 0.5
+backoff_max_seconds = 30.0
+
+
+def parse_rate_limits(rate_limits: str) -> Dict[str, float]:
+    """
+    "default=50,predicates=10" -> {"default": 50.0, "predicates": 10.0}, requests per second per endpoint class.
+    """
+    limits = {}
+    for item in (rate_limits or "").split(","):
+        if not item.strip():
+            continue
+        endpoint_class, _, rate = item.partition("=")
+        limits[endpoint_class.strip()] = float(rate)
+    return limits
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average and bursts of up to burst requests.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class AdaptiveConcurrency:
+    """
+    Limit of the requests in flight, adjusted by additive increase / multiplicative decrease: every successful
+    response raises the limit by 1 / limit, so about one per round of requests, a throttled response or a latency
+    spike halves it.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, overloaded: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded:
+                if now - self.decreased_at >= decrease_interval_seconds:
+                    self.decreased_at = now
+                    self.limit = max(float(self.min_limit), self.limit / 2)
+                    logger.warning(
+                        f"rate control: throttled or slow responses, concurrency limit down to {int(self.limit)}"
+                    )
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RateController:
+    """
+    Every SDK request goes through one controller per process: a token bucket per endpoint class, one adaptive
+    concurrency limit for the tenant, and retries with jittered exponential backoff of 429, 5xx and connection
+    errors. A Retry-After header of the server is honoured.
+    """
+
+    def __init__(self, rate_limits: Dict[str, float], max_concurrency: int, retries: int = 5):
+        self.retries = retries
+        self.rate_limits = rate_limits
+        self.buckets: Dict[str, Optional[TokenBucket]] = {}
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.latencies: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def get_bucket(self, endpoint_class: str) -> Optional[TokenBucket]:
+        with self.lock:
+            if endpoint_class not in self.buckets:
+                rate = self.rate_limits.get(endpoint_class, self.rate_limits.get("default"))
+                self.buckets[endpoint_class] = TokenBucket(rate) if rate else None
+            return self.buckets[endpoint_class]
+
+    def is_latency_spike(self, endpoint_class: str, seconds: float) -> bool:
+        with self.lock:
+            average = self.latencies.get(endpoint_class)
+            self.latencies[endpoint_class] = seconds if average is None else average * 0.9 + seconds * 0.1
+        return (
+            average is not None and seconds >= latency_spike_min_seconds and seconds > average * latency_spike_factor
+        )
+
+    @staticmethod
+    def get_backoff(attempt: int, response=None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), backoff_max_seconds)
+        # full jitter, so that the threads waiting on the same error do not come back at the same time
+        return random.uniform(0, min(backoff_max_seconds, backoff_base_seconds * (2 ** attempt)))
+
+    def request(self, method, url, **kwargs):
+        endpoint_class = get_endpoint_class(url)
+        bucket = self.get_bucket(endpoint_class)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            self.concurrency.acquire()
+            start = time.perf_counter()
+            response = None
+            try:
+                response = httpRequests.s.request(method=method, url=url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                self.concurrency.release(overloaded=True)
+                if attempt >= self.retries:
+                    raise
+                error = repr(e)
+            except Exception:
+                self.concurrency.release()
+                raise
+            else:
+                overloaded = response.status_code in throttle_status_codes or self.is_latency_spike(
+                    endpoint_class, time.perf_counter() - start
+                )
+                self.concurrency.release(overloaded=overloaded)
+                if response.status_code not in retry_status_codes or attempt >= self.retries:
+                    return response
+                error = f"HTTP {response.status_code}"
+            delay = self.get_backoff(attempt, response)
+            attempt += 1
+            metrics.add_retry("http", get_endpoint(method, url))
+            logger.warning(
+                f"{method} {urlparse(url).path} failed: {error}, retry {attempt}/{self.retries} in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+
+def install_rate_control(max_concurrency: int) -> RateController:
+    """
+    Send every request of the SDK through a RateController. When st_results runs as one of several shards, the
+    rate limits are shared out between the shards, so together they stay within the limits of the tenant.
+    """
+    shard_count = config.get("shard_count") if config.get("shard_index") >= 0 else 1
+    rate_limits = {
+        endpoint_class: rate / max(shard_count, 1)
+        for endpoint_class, rate in parse_rate_limits(config.get("rate_limits")).items()
+    }
+    rate_controller = RateController(rate_limits, max_concurrency, retries=config.get("http_retries"))
+    httpRequests.request = rate_controller.request
+    # call_with_retry only retries the errors that are not HTTP ones from now on
+    retry_policy.http_retries_handled = True
+    logger.info(f"rate control: limits {rate_limits or 'none'} requests/s, concurrency up to {max_concurrency}")
+    return rate_controller
@@ -0,0 +1,113 @@
+import json
+from collections import Counter
+from typing import Dict, Iterable, List
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["CREATE", "SKIP", "CONFLICT", "build_plan", "write_plan", "read_plan", "get_items_to_create", "summarize"]
+
+CREATE = "create"
+SKIP = "skip"
+CONFLICT = "conflict"
+
+plan_sections = ["groups", "projects", "applications"]
+
+
+def plan_item(action: str, name: str, data: dict, reason: str = None) -> dict:
+    item = {"action": action, "name": name, "data": data}
+    if reason:
+        item["reason"] = reason
+    return item
+
+
+def plan_groups(st_groups: Iterable[dict], mt_group_ids: Dict[str, str]) -> List[dict]:
+    return [
+        plan_item(SKIP if group.get("name") in mt_group_ids else CREATE, group.get("name"), group)
+        for group in st_groups
+    ]
+
+
+def plan_projects(st_projects: Iterable[dict], mt_projects: Dict[str, object]) -> List[dict]:
+    items = []
+    for project in st_projects:
+        project_name = project.get("name")
+        mt_project = mt_projects.get(project_name)
+        if mt_project is None:
+            items.append(plan_item(CREATE, project_name, project))
+            continue
+        differences = [
+            field for field in ["repoUrl", "mainBranch"]
+            if (project.get(field) or "") != (getattr(mt_project, field) or "")
+        ]
+        if differences:
+            items.append(plan_item(CONFLICT, project_name, project, reason=f"different {', '.join(differences)}"))
+        else:
+            items.append(plan_item(SKIP, project_name, project))
+    return items
+
+
+def plan_applications(st_applications: Iterable[dict], mt_applications: Dict[str, object]) -> List[dict]:
+    items = []
+    for application in st_applications:
+        application_name = application.get("name")
+        mt_application = mt_applications.get(application_name)
+        if mt_application is None:
+            items.append(plan_item(CREATE, application_name, application))
+            continue
+        st_rules = sorted((rule.get("type"), rule.get("value")) for rule in application.get("rules") or [])
+        mt_rules = sorted((rule.type, rule.value) for rule in mt_application.rules or [])
+        if st_rules != mt_rules:
+            items.append(plan_item(CONFLICT, application_name, application, reason="different rules"))
+        else:
+            items.append(plan_item(SKIP, application_name, application))
+    return items
+
+
+def build_plan(
+        st_groups: Iterable[dict],
+        st_projects: Iterable[dict],
+        st_applications: Iterable[dict],
+        mt_group_ids: Dict[str, str],
+        mt_projects: Dict[str, object],
+        mt_applications: Dict[str, object],
+) -> dict:
+    """
+    Diff the ST snapshot against name indexes of the live MT tenant, one hash lookup per ST entity.
+
+    Returns:
+        dict: {"groups": [...], "projects": [...], "applications": [...]}, every item holds the action
+            (create, skip or conflict), the entity name and its ST data
+    """
+    return {
+        "groups": plan_groups(st_groups, mt_group_ids),
+        "projects": plan_projects(st_projects, mt_projects),
+        "applications": plan_applications(st_applications, mt_applications),
+    }
+
+
+def summarize(plan: dict) -> str:
+    summaries = []
+    for section in plan_sections:
+        counter = Counter(item.get("action") for item in plan.get(section) or [])
+        counts = ", ".join(f"{action} {counter[action]}" for action in [CREATE, SKIP, CONFLICT])
+        summaries.append(f"{section}: {counts}")
+    return "; ".join(summaries)
+
+
+def get_items_to_create(plan: dict, section: str) -> List[dict]:
+    return [item.get("data") for item in plan.get(section) or [] if item.get("action") == CREATE]
+
+
+def write_plan(plan: dict, plan_file: str):
+    with open(plan_file, "w") as file:
+        json.dump(plan, file, indent=2)
+    logger.info(f"plan written to {plan_file}: {summarize(plan)}")
+
+
+def read_plan(plan_file: str) -> dict:
+    with open(plan_file, "r") as file:
+        plan = json.load(file)
+    logger.info(f"plan read from {plan_file}: {summarize(plan)}")
+    return plan
@@ -0,0 +1,221 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from CheckmarxPythonSDK.CxOne.config import config as cxone_config
+from CheckmarxPythonSDK.utilities import httpRequests
+from endpoints import get_endpoint_class
+from migration_config import config
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["OFF", "ON", "REPLAY", "ResponseCache", "install_response_cache"]
+
+OFF = "off"
+ON = "on"
+REPLAY = "replay"
+
+# endpoint classes of the read calls that are cached: get_all_projects, get_branches, get_a_list_of_scans,
+# get_sast_results_by_scan_id, get_a_list_of_applications, get_groups and the group hierarchy
+cached_endpoint_classes = ["projects", "scans", "sast-results", "applications", "groups"]
+# a write to the key class changes what the reads of these classes return
+dependent_endpoint_classes = {"predicates": ["sast-results"]}
+write_methods = ["POST", "PUT", "PATCH", "DELETE"]
+
+
+def get_scan_id(url: str, params) -> Optional[str]:
+    scan_ids = parse_qs(urlparse(url).query).get("scan-id")
+    if scan_ids:
+        return scan_ids[0]
+    return params.get("scan-id") if isinstance(params, dict) else None
+
+
+def get_predicate_scan_ids(request_body) -> Optional[List[str]]:
+    """
+    Scans of the predicates in a request body, None when a predicate does not name its scan.
+    """
+    if not isinstance(request_body, list):
+        return None
+    scan_ids = {predicate.get("scanId") if isinstance(predicate, dict) else None for predicate in request_body}
+    return None if None in scan_ids else sorted(scan_ids)
+
+
+class ResponseCache:
+    """
+    On disk cache of successful GET responses of the SDK read calls, one gzip JSON file per response under
+    <cache_dir>/<tenant>/<endpoint class>/, keyed by sha256 of url and params. The SAST results are kept in one more
+    directory per scan.
+
+    Entries older than ttl seconds are downloaded again, a hit refreshes the file mtime, and the least recently used
+    entries are evicted once the cache grows over max_mb. A successful write request to an endpoint class drops the
+    cached entries of that class, so a rerun of the MT stage does not see the groups or projects it created as missing,
+    and a predicate write drops the cached SAST results of its scans, so a rerun does not read the old states.
+    In replay mode every response has to come from the cache, a miss raises instead of going to the network.
+    """
+
+    def __init__(self, cache_dir: str, mode: str = ON, ttl: int = 3600, max_mb: int = 1024):
+        if mode not in [ON, REPLAY]:
+            raise ValueError(f"response cache mode has to be {ON} or {REPLAY}, got {mode}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.size = sum(entry_size for _, _, entry_size in self.list_entries())
+
+    def tenant_dir(self) -> str:
+        return os.path.join(self.cache_dir, cxone_config.get("tenant_name") or "default")
+
+    def get_entry_path(self, endpoint_class: str, url: str, params) -> str:
+        key = hashlib.sha256(f"{url}\n{json.dumps(params, sort_keys=True, default=str)}".encode("utf-8"))
+        return os.path.join(self.get_class_dir(endpoint_class, get_scan_id(url, params)), f"{key.hexdigest()}.json.gz")
+
+    def get_class_dir(self, endpoint_class: str, scan_id: str = None) -> str:
+        class_dir = os.path.join(self.tenant_dir(), endpoint_class)
+        return os.path.join(class_dir, scan_id) if endpoint_class == "sast-results" and scan_id else class_dir
+
+    def list_entries(self, root_dir: str = None):
+        for directory, _, file_names in os.walk(root_dir or self.cache_dir):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def load(self, path: str) -> Optional[requests.Response]:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, EOFError, ValueError, OSError):
+            return None
+        if self.mode == ON and time.time() - entry.get("created_at", 0) > self.ttl:
+            return None
+        os.utime(path)
+        response = requests.Response()
+        response.status_code = entry.get("status_code")
+        response.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        response._content = entry.get("body").encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = entry.get("url")
+        response.request = requests.Request("GET", entry.get("url")).prepare()
+        return response
+
+    def store(self, path: str, url: str, response: requests.Response):
+        entry = {
+            "url": url,
+            "created_at": time.time(),
+            "status_code": response.status_code,
+            "headers": {"Content-Type": response.headers.get("Content-Type", "application/json")},
+            "body": response.text,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as file:
+            json.dump(entry, file)
+        entry_size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.size += entry_size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        entries = sorted(self.list_entries(), key=lambda entry: entry[1])
+        self.size = sum(entry_size for _, _, entry_size in entries)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for path, _, entry_size in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= entry_size
+            evicted += 1
+        logger.info(f"response cache: evicted {evicted} entries, {self.size // (1024 * 1024)} MB left")
+
+    def invalidate(self, endpoint_class: str, scan_ids: List[str] = None):
+        """
+        Drop the cached entries of an endpoint class, or only those of the given scans.
+        """
+        class_dirs = [self.get_class_dir(endpoint_class, scan_id) for scan_id in scan_ids or [None]]
+        for class_dir in class_dirs:
+            removed_size = sum(entry_size for _, _, entry_size in self.list_entries(class_dir))
+            shutil.rmtree(class_dir, ignore_errors=True)
+            with self.lock:
+                self.size -= removed_size
+
+    def wrap(self, request_function):
+        def cached_request(method, url, params=None, **kwargs):
+            endpoint_class = get_endpoint_class(url)
+            is_cached = endpoint_class in cached_endpoint_classes
+            if self.mode == REPLAY and (method.upper() != "GET" or not is_cached):
+                raise ValueError(f"response cache replay: {method} {url} is not cached")
+            if method.upper() in write_methods:
+                response = request_function(method, url, params=params, **kwargs)
+                if response is not None and response.ok:
+                    if is_cached:
+                        self.invalidate(endpoint_class)
+                    for dependent_class in dependent_endpoint_classes.get(endpoint_class, []):
+                        self.invalidate(dependent_class, get_predicate_scan_ids(kwargs.get("json")))
+                return response
+            if method.upper() != "GET" or not is_cached:
+                return request_function(method, url, params=params, **kwargs)
+            path = self.get_entry_path(endpoint_class, url, params)
+            response = self.load(path)
+            if response is not None:
+                with self.lock:
+                    self.hits += 1
+                return response
+            with self.lock:
+                self.misses += 1
+            if self.mode == REPLAY:
+                raise ValueError(f"response cache replay: no cached response for GET {url}")
+            response = request_function(method, url, params=params, **kwargs)
+            if response is not None and response.status_code == requests.codes.ok:
+                self.store(path, url, response)
+            return response
+
+        return cached_request
+
+    def summary(self) -> str:
+        return f"response cache: {self.hits} hits, {self.misses} misses, {self.size // (1024 * 1024)} MB"
+
+
+def install_response_cache() -> Optional[ResponseCache]:
+    """
+    Put the response cache in front of every request of the SDK, according to option response_cache (off, on or
+    replay). In replay mode no access token is requested either.
+
+    Returns:
+        ResponseCache: None when the cache is off
+    """
+    mode = (config.get("response_cache") or OFF).lower()
+    if mode == OFF:
+        return None
+    response_cache = ResponseCache(
+        cache_dir=config.get("response_cache_dir"),
+        mode=mode,
+        ttl=config.get("response_cache_ttl"),
+        max_mb=config.get("response_cache_max_mb"),
+    )
+    httpRequests.request = response_cache.wrap(httpRequests.request)
+    if mode == REPLAY:
+        httpRequests.auth_header.update({"Authorization": "Bearer replay"})
+    logger.info(f"response cache {mode}, directory {response_cache.cache_dir}, {response_cache.size} bytes cached")
+    return response_cache
@@ -0,0 +1,563 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from itertools import islice
+import sys
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+from metrics import metrics
+from migration_config import config
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = [
+    "ResultStore", "PredicateIndex", "batched", "open_results_db", "merge_results_dbs", "read_project_branches"
+]
+
+# normalized schema: project/branch pairs, queries and file paths are stored once and referenced by id from findings
+schema_version = 2
+
+sql_create_tables = [
+    """
+    CREATE TABLE IF NOT EXISTS project_branches (
+    id INTEGER PRIMARY KEY,
+    project_name TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    UNIQUE (project_name, branch)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS queries (
+    id INTEGER PRIMARY KEY,
+    cwe_id INTEGER,
+    language_name TEXT,
+    query_group TEXT,
+    query TEXT,
+    UNIQUE (cwe_id, language_name, query_group, query)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS file_paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS findings (
+    project_branch_id INTEGER NOT NULL REFERENCES project_branches (id),
+    similarity_id INTEGER NOT NULL,
+    query_id INTEGER REFERENCES queries (id),
+    source_file_id INTEGER REFERENCES file_paths (id),
+    source_line INTEGER,
+    source_column INTEGER,
+    source_name TEXT,
+    dest_file_id INTEGER REFERENCES file_paths (id),
+    dest_line INTEGER,
+    dest_column INTEGER,
+    dest_name TEXT,
+    result_state TEXT,
+    result_severity TEXT
+    )
+    """,
+    # covering index, the predicate read of mt_results never touches the findings table itself
+    """
+    CREATE INDEX IF NOT EXISTS findings_predicate_index
+    ON findings (project_branch_id, similarity_id, result_state, result_severity)
+    """,
+]
+
+# the old flat results table, kept readable as a view for ad hoc queries
+sql_create_results_view = """
+CREATE VIEW IF NOT EXISTS results AS
+SELECT findings.rowid AS id, project_name, branch, cwe_id, language_name, query_group, query,
+source_file.path AS source_file_name, source_line, source_column, source_name,
+dest_file.path AS dest_file_name, dest_line, dest_column, dest_name,
+result_state, result_severity, '' AS comment, similarity_id
+FROM findings
+JOIN project_branches ON project_branches.id = findings.project_branch_id
+LEFT JOIN queries ON queries.id = findings.query_id
+LEFT JOIN file_paths AS source_file ON source_file.id = findings.source_file_id
+LEFT JOIN file_paths AS dest_file ON dest_file.id = findings.dest_file_id
+"""
+
+sql_migrate_legacy_results = [
+    "ALTER TABLE results RENAME TO legacy_results",
+    *sql_create_tables,
+    """
+    INSERT OR IGNORE INTO project_branches (project_name, branch)
+    SELECT DISTINCT project_name, branch FROM legacy_results
+    """,
+    """
+    INSERT OR IGNORE INTO queries (cwe_id, language_name, query_group, query)
+    SELECT DISTINCT cwe_id, language_name, query_group, query FROM legacy_results
+    """,
+    """
+    INSERT OR IGNORE INTO file_paths (path)
+    SELECT source_file_name FROM legacy_results WHERE source_file_name IS NOT NULL
+    UNION SELECT dest_file_name FROM legacy_results WHERE dest_file_name IS NOT NULL
+    """,
+    """
+    INSERT INTO findings
+    SELECT project_branches.id, CAST(similarity_id AS INTEGER), queries.id,
+    source_file.id, source_line, source_column, source_name,
+    dest_file.id, dest_line, dest_column, dest_name,
+    result_state, result_severity
+    FROM legacy_results
+    JOIN project_branches USING (project_name, branch)
+    LEFT JOIN queries ON queries.cwe_id IS legacy_results.cwe_id
+    AND queries.language_name IS legacy_results.language_name
+    AND queries.query_group IS legacy_results.query_group AND queries.query IS legacy_results.query
+    LEFT JOIN file_paths AS source_file ON source_file.path = legacy_results.source_file_name
+    LEFT JOIN file_paths AS dest_file ON dest_file.path = legacy_results.dest_file_name
+    """,
+    "DROP TABLE legacy_results",
+]
+
+sql_select_project_branches = """
+SELECT id, project_name, branch FROM project_branches
+WHERE EXISTS (SELECT 1 FROM findings WHERE findings.project_branch_id = project_branches.id)
+"""
+
+sql_select_predicates = """
+SELECT project_branch_id, similarity_id, result_state, result_severity FROM findings
+ORDER BY project_branch_id
+"""
+
+sql_insert_finding = "INSERT INTO findings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+sql_delete_project_branch = "DELETE FROM findings WHERE project_branch_id = ?"
+
+# rows of a refreshed project/branch are staged in a connection private table and swapped in by one operation, so the
+# old rows stay visible until the new ones are complete
+sql_create_staging = [
+    "CREATE TEMP TABLE IF NOT EXISTS staged_findings AS SELECT * FROM findings WHERE 0",
+    "CREATE INDEX IF NOT EXISTS temp.staged_findings_index ON staged_findings (project_branch_id)",
+]
+sql_insert_staged_finding = "INSERT INTO temp.staged_findings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+sql_swap_project_branch = [
+    sql_delete_project_branch,
+    "INSERT INTO findings SELECT * FROM temp.staged_findings WHERE project_branch_id = ?",
+    "DELETE FROM temp.staged_findings WHERE project_branch_id = ?",
+]
+sql_discard_staged_project_branch = "DELETE FROM temp.staged_findings WHERE project_branch_id = ?"
+
+# interned values: read the id, insert only if missing. The queries key has nullable columns, which UNIQUE and
+# INSERT OR IGNORE treat as distinct, so the lookup compares with IS and takes the lowest id
+sql_insert_project_branch = "INSERT INTO project_branches (project_name, branch) VALUES (?, ?)"
+sql_select_project_branch = "SELECT id FROM project_branches WHERE project_name = ? AND branch = ?"
+sql_insert_query = "INSERT INTO queries (cwe_id, language_name, query_group, query) VALUES (?, ?, ?, ?)"
+sql_select_query = """
+SELECT MIN(id) FROM queries WHERE cwe_id IS ? AND language_name IS ? AND query_group IS ? AND query IS ?
+HAVING MIN(id) IS NOT NULL
+"""
+sql_insert_file_path = "INSERT INTO file_paths (path) VALUES (?)"
+sql_select_file_path = "SELECT id FROM file_paths WHERE path = ?"
+
+# merge of a shard database attached as "shard": its dictionaries are interned into the main ones, then the findings
+# of every project/branch it holds replace the main ones, one finding per (project, branch, similarity_id)
+sql_merge_shard = [
+    """
+    INSERT OR IGNORE INTO main.project_branches (project_name, branch)
+    SELECT project_name, branch FROM shard.project_branches
+    """,
+    """
+    INSERT INTO main.queries (cwe_id, language_name, query_group, query)
+    SELECT DISTINCT cwe_id, language_name, query_group, query FROM shard.queries AS shard_queries
+    WHERE NOT EXISTS (
+    SELECT 1 FROM main.queries AS main_queries WHERE main_queries.cwe_id IS shard_queries.cwe_id
+    AND main_queries.language_name IS shard_queries.language_name
+    AND main_queries.query_group IS shard_queries.query_group AND main_queries.query IS shard_queries.query
+    )
+    """,
+    "INSERT OR IGNORE INTO main.file_paths (path) SELECT path FROM shard.file_paths",
+    """
+    DELETE FROM main.findings WHERE project_branch_id IN (
+    SELECT main_project_branches.id FROM shard.project_branches AS shard_project_branches
+    JOIN main.project_branches AS main_project_branches USING (project_name, branch)
+    WHERE EXISTS (SELECT 1 FROM shard.findings WHERE project_branch_id = shard_project_branches.id)
+    )
+    """,
+    """
+    INSERT INTO main.findings
+    SELECT main_project_branches.id, findings.similarity_id, (
+    SELECT MIN(main_queries.id) FROM main.queries AS main_queries
+    WHERE main_queries.cwe_id IS shard_queries.cwe_id AND main_queries.language_name IS shard_queries.language_name
+    AND main_queries.query_group IS shard_queries.query_group AND main_queries.query IS shard_queries.query
+    ),
+    main_source_file.id, source_line, source_column, source_name,
+    main_dest_file.id, dest_line, dest_column, dest_name,
+    result_state, result_severity
+    FROM shard.findings AS findings
+    JOIN shard.project_branches AS shard_project_branches ON shard_project_branches.id = findings.project_branch_id
+    JOIN main.project_branches AS main_project_branches USING (project_name, branch)
+    LEFT JOIN shard.queries AS shard_queries ON shard_queries.id = findings.query_id
+    LEFT JOIN shard.file_paths AS shard_source_file ON shard_source_file.id = findings.source_file_id
+    LEFT JOIN main.file_paths AS main_source_file ON main_source_file.path = shard_source_file.path
+    LEFT JOIN shard.file_paths AS shard_dest_file ON shard_dest_file.id = findings.dest_file_id
+    LEFT JOIN main.file_paths AS main_dest_file ON main_dest_file.path = shard_dest_file.path
+    WHERE findings.rowid IN (
+    SELECT MIN(rowid) FROM shard.findings GROUP BY project_branch_id, similarity_id
+    )
+    """,
+]
+
+pragmas = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+]
+
+# the writer commits once the queue is drained, or earlier when this many project/branch units or seconds are waiting
+group_commit_size = 32
+group_commit_seconds = 1.0
+# producers check this often whether the writer thread is still alive while they wait for it
+writer_poll_seconds = 1.0
+
+
+# the writer keeps at most this many interned ids per dictionary in memory, a miss is read back from the table
+intern_cache_size = 1000000
+
+
+def open_results_db(db_file: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    """
+    Connect to a results.db, create the normalized schema, and migrate the flat results table of older versions.
+    """
+    connection = sqlite3.connect(db_file, check_same_thread=check_same_thread)
+    for pragma in pragmas:
+        connection.execute(pragma)
+    legacy_table = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'results'"
+    ).fetchone()
+    if legacy_table:
+        start = time.perf_counter()
+        logger.info(f"migrate {db_file} to the normalized schema")
+        with connection:
+            for sql in sql_migrate_legacy_results:
+                connection.execute(sql)
+        connection.execute("VACUUM")
+        logger.info(f"migrated {db_file} in {time.perf_counter() - start:.1f}s")
+    with connection:
+        for sql in sql_create_tables:
+            connection.execute(sql)
+        connection.execute(sql_create_results_view)
+        connection.execute(f"PRAGMA user_version={schema_version}")
+    return connection
+
+
+def read_project_branches(db_file: str) -> Set[Tuple[str, str]]:
+    """
+    Project/branch pairs with findings in db_file, an empty set when db_file does not exist.
+    """
+    if not os.path.exists(db_file):
+        return set()
+    connection = open_results_db(db_file)
+    try:
+        return {(project_name, branch) for _, project_name, branch in connection.execute(sql_select_project_branches)}
+    finally:
+        connection.close()
+
+
+def merge_results_dbs(db_file: str, shard_db_files: List[str]) -> int:
+    """
+    Merge shard databases into db_file. A project/branch found in a shard replaces the one in db_file, and keeps one
+    finding per similarity_id.
+
+    Every shard database is renamed to <shard>.merged once its merge is committed, so that a later run does not merge
+    its old rows over db_file again.
+
+    Returns:
+        int: number of findings in db_file after the merge
+    """
+    connection = open_results_db(db_file)
+    try:
+        for shard_db_file in shard_db_files:
+            start = time.perf_counter()
+            open_results_db(shard_db_file).close()
+            connection.execute("ATTACH DATABASE ? AS shard", (shard_db_file,))
+            try:
+                with connection:
+                    for sql in sql_merge_shard:
+                        connection.execute(sql)
+            finally:
+                connection.execute("DETACH DATABASE shard")
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(shard_db_file + suffix):
+                    os.replace(shard_db_file + suffix, f"{shard_db_file}.merged{suffix}")
+            logger.info(f"merged {shard_db_file} into {db_file} in {time.perf_counter() - start:.1f}s")
+        return connection.execute("SELECT COUNT(*) FROM findings").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def batched(rows: Iterable[tuple], batch_size: int) -> Iterator[List[tuple]]:
+    rows = iter(rows)
+    batch = list(islice(rows, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, batch_size))
+
+
+class ResultStore:
+    """
+    Owns the results.db connection for the whole run.
+
+    The schema is set up once, all writes go through one writer thread fed by a bounded queue, so several producer
+    threads can write at the same time. Rows of a project/branch are committed before write_rows or swap_rows
+    returns.
+
+    A row is (cwe_id, language_name, query_group, query, source_file_name, source_line, source_column, source_name,
+    dest_file_name, dest_line, dest_column, dest_name, result_state, result_severity, similarity_id). The writer
+    replaces the query and the file names by ids of the queries and file_paths dictionaries.
+    """
+
+    def __init__(self, db_file: str = "results.db", batch_size: int = None, queue_size: int = 64):
+        self.db_file = db_file
+        self.batch_size = batch_size or config.get("db_batch_size")
+        self.connection = open_results_db(db_file, check_same_thread=False)
+        for sql in sql_create_staging:
+            self.connection.execute(sql)
+        self.lock = threading.Lock()
+        self.error = None
+        self.project_branch_ids = {}
+        self.query_ids = {}
+        self.file_path_ids = {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writer = threading.Thread(target=self._write_loop, name="result-store-writer", daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_project_branches(self) -> Set[Tuple[str, str]]:
+        with self.lock:
+            return {
+                (project_name, branch)
+                for _, project_name, branch in self.connection.execute(sql_select_project_branches)
+            }
+
+    def write_rows(self, project_name: str, branch: str, rows: Iterable[tuple]) -> int:
+        """
+        Replace the rows of a project/branch, block until they are committed.
+
+        Returns:
+            int: number of rows written
+        """
+        self._check_error()
+        row_count = 0
+        self._put(("delete", (project_name, branch)))
+        try:
+            for batch in batched(rows, self.batch_size):
+                self._put(("insert", ((project_name, branch), batch)))
+                row_count += len(batch)
+        except Exception:
+            # the producer failed half way, do not leave a partial project/branch behind
+            self._put(("delete", (project_name, branch)))
+            raise
+        self._wait_for_commit()
+        return row_count
+
+    def swap_rows(self, project_name: str, branch: str, rows: Iterable[tuple]) -> int:
+        """
+        Replace the rows of a project/branch in one transaction, block until they are committed. The new rows are
+        staged first, so readers and a failed download keep the old rows.
+
+        Returns:
+            int: number of rows written
+        """
+        self._check_error()
+        row_count = 0
+        try:
+            for batch in batched(rows, self.batch_size):
+                self._put(("stage", ((project_name, branch), batch)))
+                row_count += len(batch)
+        except Exception:
+            self._put(("discard", (project_name, branch)))
+            raise
+        self._put(("swap", (project_name, branch)))
+        self._wait_for_commit()
+        return row_count
+
+    def close(self):
+        if self.writer.is_alive():
+            self._put(("stop", None))
+        self.writer.join()
+        self.connection.close()
+        self._check_error()
+
+    def _put(self, item: tuple):
+        while True:
+            try:
+                self.queue.put(item, timeout=writer_poll_seconds)
+                return
+            except queue.Full:
+                if not self.writer.is_alive():
+                    self._check_error()
+                    raise RuntimeError("results.db writer is not running")
+
+    def _wait_for_commit(self):
+        committed = threading.Event()
+        self._put(("commit", committed))
+        while not committed.wait(writer_poll_seconds):
+            if not self.writer.is_alive():
+                break
+        self._check_error()
+        if not committed.is_set():
+            raise RuntimeError("results.db writer is not running")
+
+    def _check_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"results.db writer failed: {self.error!r}")
+
+    def _write_loop(self):
+        pending_commits = []
+        try:
+            self._process_queue(pending_commits)
+        except BaseException as e:
+            logger.error(f"results.db writer stopped: {e!r}")
+            self.error = self.error or e
+            raise
+        finally:
+            # never leave a producer waiting for a commit that will not happen
+            for committed in pending_commits:
+                committed.set()
+
+    def _process_queue(self, pending_commits: List[threading.Event]):
+        first_pending_at = 0.0
+        while True:
+            operation, payload = self.queue.get()
+            if operation == "stop":
+                self._commit(pending_commits)
+                break
+            if operation == "commit":
+                if not pending_commits:
+                    first_pending_at = time.monotonic()
+                pending_commits.append(payload)
+            elif self.error is None:
+                try:
+                    self._apply(operation, payload)
+                except Exception as e:
+                    # a bad row fails the run like a SQLite error, the writer keeps draining the queue
+                    logger.error(f"results.db write failed: {e!r}")
+                    self.error = e
+            if pending_commits and (
+                    self.queue.empty()
+                    or len(pending_commits) >= group_commit_size
+                    or time.monotonic() - first_pending_at >= group_commit_seconds
+            ):
+                self._commit(pending_commits)
+                pending_commits.clear()
+
+    def _apply(self, operation: str, payload):
+        with self.lock:
+            if operation == "delete":
+                with metrics.timer("db", "results delete"):
+                    self.connection.execute(sql_delete_project_branch, (self._get_project_branch_id(payload),))
+            elif operation == "stage":
+                with metrics.timer("db", "results stage"):
+                    self.connection.executemany(sql_insert_staged_finding, self._to_findings(*payload))
+            elif operation == "swap":
+                with metrics.timer("db", "results swap"):
+                    project_branch_id = self._get_project_branch_id(payload)
+                    for sql in sql_swap_project_branch:
+                        self.connection.execute(sql, (project_branch_id,))
+            elif operation == "discard":
+                self.connection.execute(sql_discard_staged_project_branch, (self._get_project_branch_id(payload),))
+            else:
+                with metrics.timer("db", "results insert"):
+                    self.connection.executemany(sql_insert_finding, self._to_findings(*payload))
+
+    def _get_id(self, cache: dict, sql_insert: str, sql_select: str, key: tuple) -> int:
+        interned_id = cache.get(key)
+        if interned_id is None:
+            row = self.connection.execute(sql_select, key).fetchone()
+            interned_id = row[0] if row else self.connection.execute(sql_insert, key).lastrowid
+            if len(cache) >= intern_cache_size:
+                cache.clear()
+            cache[key] = interned_id
+        return interned_id
+
+    def _get_project_branch_id(self, project_branch: Tuple[str, str]) -> int:
+        return self._get_id(
+            self.project_branch_ids, sql_insert_project_branch, sql_select_project_branch, project_branch
+        )
+
+    def _get_file_path_id(self, path: str):
+        if path is None:
+            return None
+        return self._get_id(self.file_path_ids, sql_insert_file_path, sql_select_file_path, (path,))
+
+    def _to_findings(self, project_branch: Tuple[str, str], rows: List[tuple]) -> Iterator[tuple]:
+        project_branch_id = self._get_project_branch_id(project_branch)
+        for (cwe_id, language_name, query_group, query, source_file_name, source_line, source_column, source_name,
+             dest_file_name, dest_line, dest_column, dest_name, result_state, result_severity, similarity_id) in rows:
+            query_id = self._get_id(
+                self.query_ids, sql_insert_query, sql_select_query, (cwe_id, language_name, query_group, query)
+            )
+            yield (
+                project_branch_id, int(similarity_id), query_id,
+                self._get_file_path_id(source_file_name), source_line, source_column, source_name,
+                self._get_file_path_id(dest_file_name), dest_line, dest_column, dest_name,
+                result_state, result_severity,
+            )
+
+    def _commit(self, pending_commits: List[threading.Event]):
+        if self.error is None:
+            try:
+                with self.lock, metrics.timer("db", "results commit"):
+                    self.connection.commit()
+            except Exception as e:
+                logger.error(f"results.db commit failed: {e!r}")
+                self.error = e
+        for committed in pending_commits:
+            committed.set()
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class PredicateIndex:
+    """
+    ST triage of every project/branch, read from results.db in one ordered pass over the covering index.
+
+    Maps (project_name, branch) to {similarity_id: (result_state, result_severity, comment)}, the repeated strings
+    are interned so that millions of rows stay compact. ST comments are not migrated, comment is always "".
+    """
+
+    def __init__(self):
+        self.branches: Dict[Tuple[str, str], Dict[int, Tuple[str, str, str]]] = {}
+
+    @classmethod
+    def load(cls, db_file: str = "results.db") -> "PredicateIndex":
+        index = cls()
+        start = time.perf_counter()
+        connection = open_results_db(db_file)
+        try:
+            project_branches = {
+                project_branch_id: (project_name, branch)
+                for project_branch_id, project_name, branch in connection.execute(sql_select_project_branches)
+            }
+            current_id = None
+            current_predicates = None
+            for project_branch_id, similarity_id, state, severity in connection.execute(sql_select_predicates):
+                if project_branch_id != current_id:
+                    current_id = project_branch_id
+                    current_predicates = index.branches.setdefault(project_branches.get(project_branch_id), {})
+                current_predicates[similarity_id] = (intern(state), intern(severity), "")
+        except sqlite3.OperationalError as e:
+            logger.info(f"couldn't read predicates data from {db_file}: {e!r}")
+        finally:
+            connection.close()
+        metrics.observe("db", "predicate index load", time.perf_counter() - start)
+        logger.info(f"loaded predicates of {len(index.branches)} project/branch pairs from {db_file}")
+        return index
+
+    def get(self, project_name: str, branch: str) -> Dict[int, Tuple[str, str, str]]:
+        return self.branches.get((project_name, branch)) or {}
@@ -0,0 +1,70 @@
+import re
+import time
+import logging
+from typing import Optional
+
+from requests.exceptions import RequestException
+from metrics import metrics
+
+logger = logging.getLogger("main")
+
+__all__ = ["call_with_retry", "is_retryable"]
+
+# set by the rate control once it retries 429, 5xx and connection errors of every request itself
+http_retries_handled = False
+transient_status_codes = [429, 500, 502, 503, 504]
+http_status_pattern = re.compile(r"HttpStatusCode: (\d+)")
+
+
+def get_http_status(error: Exception) -> Optional[int]:
+    """
+    HTTP status of an SDK error: CxError carries it as code, check_response raises ValueError("HttpStatusCode: 404").
+    """
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    match = http_status_pattern.search(" ".join(str(arg) for arg in error.args))
+    return int(match.group(1)) if match else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Other 4xx responses fail the same way every time and are never retried. Transient HTTP errors are only retried
+    here when the rate control does not retry them already, so the retries do not multiply.
+    """
+    status = get_http_status(error)
+    if status is not None:
+        return status in transient_status_codes and not http_retries_handled
+    if isinstance(error, RequestException):
+        return not http_retries_handled
+    return True
+
+
+def call_with_retry(function, *args, retries: int = 3, backoff_factor: float = 1.0, description: str = "",
+                    endpoint: str = None, **kwargs):
+    """
+    Call function, retry it with exponential backoff when it raises an error that is_retryable.
+
+    Args:
+        function (callable):
+        retries (int): number of retries after the first attempt
+        backoff_factor (float): seconds to sleep before the first retry, doubled on every further retry
+        description (str): used in the log message
+        endpoint (str): metrics series of the HTTP endpoint the function calls, e.g. "GET /api/scans", whose retries
+            are counted; the function name when it is not set
+
+    Returns:
+        the return value of function
+    """
+    attempt = 0
+    while True:
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = backoff_factor * (2 ** attempt)
+            attempt += 1
+            metrics.add_retry("http", endpoint or function.__name__)
+            logger.warning(f"{description or function.__name__} failed: {e!r}, retry {attempt}/{retries} in {delay}s")
+            time.sleep(delay)
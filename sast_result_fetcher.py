@@ -0,0 +1,109 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterator, List, Optional
+from CheckmarxPythonSDK.CxOne import (
+    get_sast_results_by_scan_id,
+)
+from CheckmarxPythonSDK.CxOne.dto import SastResult
+from migration_config import config
+from retry_policy import call_with_retry
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = [
+    "get_sast_results_page", "get_sast_result_count", "iter_sast_result_pages", "get_all_sast_result_by_scan_id"
+]
+
+page_size = 100
+sort = ["+status", "+severity", "-queryname"]
+
+
+def get_sast_results_page(
+        scan_id: str, offset: int, limit: int = page_size, state: Optional[List[str]] = None,
+        severity: Optional[List[str]] = None, include_nodes: bool = True,
+) -> dict:
+    return call_with_retry(
+        get_sast_results_by_scan_id,
+        scan_id=scan_id, offset=offset, limit=limit, sort=sort, state=state, severity=severity,
+        include_nodes=include_nodes,
+        retries=config.get("page_retries"),
+        description=f"get sast results of scan {scan_id} at offset {offset}",
+        endpoint="GET /api/sast-results",
+    )
+
+
+def get_sast_result_count(scan_id: str, state: Optional[List[str]] = None) -> int:
+    """
+    Number of results of a scan in the given states, from a one result page without nodes.
+    """
+    page = get_sast_results_page(scan_id, offset=0, limit=1, state=state, include_nodes=False)
+    return int(page.get("totalCount") or 0)
+
+
+def iter_sast_result_pages(
+        scan_id: str, page_workers: int = None, state: Optional[List[str]] = None,
+        severity: Optional[List[str]] = None, include_nodes: bool = True, first_page: Optional[dict] = None,
+) -> Iterator[List[SastResult]]:
+    """
+    Yield the SAST results of a scan page by page, in the same order as the sequential offset walk.
+
+    The first page returns totalCount, so the remaining offsets are known up front and are downloaded by
+    page_workers threads. Each page is retried on its own, a failed page does not restart the scan.
+
+    The state and severity filters are applied by the server, so filtered out results are never downloaded and
+    totalCount only counts the matching ones. Without include_nodes the results have no nodes, which makes every
+    result a fraction of its size.
+
+    Args:
+        scan_id (str):
+        page_workers (int): number of concurrent page downloads, 1 means sequential
+        state (list of str): only results in these states, e.g. ["CONFIRMED", "URGENT"], None for all
+        severity (list of str): only results of these severities, None for all
+        include_nodes (bool): download the nodes of every result
+        first_page (dict): the first page, when the caller already requested it with the same filters
+
+    Returns:
+        Iterator[List[SastResult]]
+    """
+    page_workers = page_workers or config.get("page_workers")
+    get_page = partial(get_sast_results_page, state=state, severity=severity, include_nodes=include_nodes)
+    if first_page is None:
+        first_page = get_page(scan_id, offset=0)
+    total_count = int(first_page.get("totalCount") or 0)
+    yield first_page.get("results")
+    offsets = range(page_size, total_count, page_size)
+    if page_workers <= 1 or len(offsets) <= 1:
+        for offset in offsets:
+            yield get_page(scan_id, offset=offset).get("results")
+        return
+    logger.info(f"scan {scan_id}: download {len(offsets)} remaining pages with {page_workers} workers")
+    # only keep a bounded window of pages in flight, so that memory does not grow with the size of the scan
+    with ThreadPoolExecutor(max_workers=page_workers) as executor:
+        pending = deque()
+        offset_iterator = iter(offsets)
+        for offset in offset_iterator:
+            pending.append(executor.submit(get_page, scan_id, offset))
+            if len(pending) >= page_workers * 2:
+                break
+        while pending:
+            page = pending.popleft().result()
+            next_offset = next(offset_iterator, None)
+            if next_offset is not None:
+                pending.append(executor.submit(get_page, scan_id, next_offset))
+            yield page.get("results")
+
+
+def get_all_sast_result_by_scan_id(
+        scan_id, page_workers: int = None, state: Optional[List[str]] = None, severity: Optional[List[str]] = None,
+        include_nodes: bool = True,
+) -> List[SastResult]:
+    sast_results = []
+    pages = iter_sast_result_pages(
+        scan_id, page_workers=page_workers, state=state, severity=severity, include_nodes=include_nodes
+    )
+    for page in pages:
+        sast_results.extend(page)
+    return sast_results
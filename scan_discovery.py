@@ -0,0 +1,82 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from CheckmarxPythonSDK.CxOne import (
+    get_a_list_of_scans,
+)
+from CheckmarxPythonSDK.CxOne.dto import Project, Scan
+from migration_config import config
+from retry_policy import call_with_retry
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["ProjectBranch", "get_branches_to_process", "build_latest_scan_index", "get_project_branch_units"]
+
+excluded_project_names = ["CxPSEMEA-Query Migration Project"]
+scan_page_size = 500
+
+ProjectBranch = namedtuple("ProjectBranch", ["project_id", "project_name", "branch", "scan_id"])
+
+
+def get_branches_to_process() -> List[str]:
+    return [branch.strip() for branch in config.get("branches").split(",") if branch.strip()]
+
+
+def get_scans_page(branches: List[str], offset: int):
+    return call_with_retry(
+        get_a_list_of_scans,
+        offset=offset, limit=scan_page_size, branches=branches, sort=["-created_at"],
+        retries=config.get("page_retries"),
+        description=f"get scans at offset {offset}",
+        endpoint="GET /api/scans",
+    )
+
+
+def build_latest_scan_index(branches: List[str]) -> Dict[Tuple[str, str], Scan]:
+    """
+    Page once through the scans of the whole tenant on the given branches and keep the latest scan of every
+    (project_id, branch). The pages after the first one are downloaded by page_workers threads.
+    """
+    index = {}
+
+    def add_scans(scans_collection):
+        for scan in scans_collection.scans:
+            key = (scan.projectId, scan.branch)
+            latest_scan = index.get(key)
+            if latest_scan is None or (scan.createdAt or "") > (latest_scan.createdAt or ""):
+                index[key] = scan
+
+    first_page = get_scans_page(branches, offset=0)
+    add_scans(first_page)
+    # totalCount counts every scan of the tenant, filteredTotalCount only the ones on the branches, 0 included
+    total_count = first_page.filteredTotalCount
+    if total_count is None:
+        total_count = first_page.totalCount
+    total_count = int(total_count or 0)
+    offsets = range(scan_page_size, total_count, scan_page_size)
+    logger.info(f"index latest scans: {total_count} scans on branches {branches}, {len(offsets) + 1} pages")
+    with ThreadPoolExecutor(max_workers=config.get("page_workers")) as executor:
+        for scans_collection in executor.map(lambda offset: get_scans_page(branches, offset), offsets):
+            add_scans(scans_collection)
+    logger.info(f"index latest scans: {len(index)} project/branch pairs")
+    return index
+
+
+def get_project_branch_units(projects: List[Project]) -> List[ProjectBranch]:
+    """
+    Find the project/branch pairs to process together with their latest scan, from one tenant wide scan index
+    instead of listing the branches and the last scan of every project.
+    """
+    branches = get_branches_to_process()
+    scan_index = build_latest_scan_index(branches)
+    units = []
+    for project in projects:
+        if project.name in excluded_project_names:
+            continue
+        for branch in branches:
+            scan = scan_index.get((project.id, branch))
+            if scan is not None:
+                units.append(ProjectBranch(project.id, project.name, branch, scan.id))
+    return units
@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+import zlib
+from typing import Iterable, List
+
+from migration_config import config
+from scan_discovery import ProjectBranch
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = [
+    "get_shard", "is_in_shard", "get_shard_file", "get_shard_files", "write_shard_units", "read_shard_units",
+    "run_shard_processes",
+]
+
+
+def get_shard(project_name: str, shard_count: int) -> int:
+    """
+    Stable shard of a project, the same on every machine and in every run.
+    """
+    return zlib.crc32(project_name.encode("utf-8")) % shard_count
+
+
+def is_in_shard(project_name: str, shard_index: int = None, shard_count: int = None) -> bool:
+    shard_index = config.get("shard_index") if shard_index is None else shard_index
+    shard_count = shard_count or config.get("shard_count")
+    if shard_count <= 1 or shard_index < 0:
+        return True
+    return get_shard(project_name, shard_count) == shard_index
+
+
+def get_shard_file(file_name: str, shard_index: int, shard_count: int) -> str:
+    """
+    "results.db" -> "results.shard-2-of-8.db", file_name itself when not sharded or empty.
+    """
+    if not file_name or shard_count <= 1 or shard_index < 0:
+        return file_name
+    name, extension = os.path.splitext(file_name)
+    return f"{name}.shard-{shard_index}-of-{shard_count}{extension}"
+
+
+def get_shard_files(file_name: str, shard_count: int) -> List[str]:
+    return [get_shard_file(file_name, shard_index, shard_count) for shard_index in range(shard_count)]
+
+
+def write_shard_units(units: Iterable[ProjectBranch], units_file: str, shard_count: int) -> List[str]:
+    """
+    Split the project/branch units discovered once by the coordinator into one JSON file per shard.
+
+    Returns:
+        List[str]: units file of every shard
+    """
+    shard_units = [[] for _ in range(shard_count)]
+    for unit in units:
+        shard_units[get_shard(unit.project_name, shard_count)].append(list(unit))
+    units_files = get_shard_files(units_file, shard_count)
+    for shard_index, shard_units_file in enumerate(units_files):
+        with open(shard_units_file, "w") as file:
+            json.dump(shard_units[shard_index], file)
+    return units_files
+
+
+def read_shard_units(units_file: str) -> List[ProjectBranch]:
+    with open(units_file, "r") as file:
+        return [ProjectBranch(*unit) for unit in json.load(file)]
+
+
+def run_shard_processes(script: str, shard_count: int, shard_arguments: List[List[str]] = None) -> List[int]:
+    """
+    Run shard_count processes of script with the command line of this process, each with its own
+    --migration_shard_index and shard_arguments, and wait for all of them.
+
+    Returns:
+        List[int]: exit code of every shard
+    """
+    processes = []
+    for shard_index in range(shard_count):
+        command = [sys.executable, script, *sys.argv[1:], "--migration_shard_index", str(shard_index)]
+        if shard_arguments:
+            command.extend(shard_arguments[shard_index])
+        logger.info(f"start shard {shard_index + 1}/{shard_count}")
+        processes.append(subprocess.Popen(command))
+    exit_codes = [process.wait() for process in processes]
+    for shard_index, exit_code in enumerate(exit_codes):
+        if exit_code != 0:
+            logger.error(f"shard {shard_index + 1}/{shard_count} failed with exit code {exit_code}")
+    return exit_codes
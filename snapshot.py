@@ -0,0 +1,116 @@
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["SNAPSHOT_FORMAT", "SNAPSHOT_VERSION", "SnapshotWriter", "read_manifest", "read_section"]
+
+SNAPSHOT_FORMAT = "cx_one_st_to_mt.snapshot"
+SNAPSHOT_VERSION = 1
+manifest_file_name = "manifest.json"
+time_stamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def section_file_name(section: str) -> str:
+    return f"{section}.jsonl.gz"
+
+
+class SnapshotWriter:
+    """
+    Write a tenant snapshot as a directory of gzip compressed JSON Lines files, one per section (groups, projects,
+    applications), plus a manifest.json header with the format version and the record count of every section.
+
+    Records go to disk as soon as they are written, the manifest is written last by close(), so a snapshot without a
+    manifest is an unfinished export.
+    """
+
+    def __init__(self, snapshot_dir: str):
+        self.snapshot_dir = snapshot_dir
+        os.makedirs(snapshot_dir, exist_ok=True)
+        manifest_path = os.path.join(snapshot_dir, manifest_file_name)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self.files = {}
+        self.counts = {}
+
+    def write(self, section: str, record: dict):
+        file = self.files.get(section)
+        if file is None:
+            file = gzip.open(os.path.join(self.snapshot_dir, section_file_name(section)), "wt", encoding="utf-8")
+            self.files[section] = file
+            self.counts[section] = 0
+        file.write(json.dumps(record, separators=(",", ":")))
+        file.write("\n")
+        self.counts[section] += 1
+
+    def write_all(self, section: str, records: Iterable[dict]) -> int:
+        count = 0
+        for record in records:
+            self.write(section, record)
+            count += 1
+        return count
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created_at": datetime.now(timezone.utc).strftime(time_stamp_format),
+            "sections": {
+                section: {"file": section_file_name(section), "count": count}
+                for section, count in self.counts.items()
+            },
+        }
+        manifest_path = os.path.join(self.snapshot_dir, manifest_file_name)
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        sections = ", ".join(f"{section}: {count}" for section, count in self.counts.items())
+        logger.info(f"snapshot written to {self.snapshot_dir} ({sections})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for file in self.files.values():
+                file.close()
+
+
+def read_manifest(snapshot_dir: str) -> dict:
+    manifest_path = os.path.join(snapshot_dir, manifest_file_name)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"{snapshot_dir} is not a complete snapshot, {manifest_file_name} is missing")
+    with open(manifest_path, "r") as file:
+        manifest = json.load(file)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"{snapshot_dir} is not a snapshot, format: {manifest.get('format')}")
+    if manifest.get("version", 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"snapshot version {manifest.get('version')} is newer than supported {SNAPSHOT_VERSION}")
+    return manifest
+
+
+def read_section(snapshot_dir: str, section: str) -> Iterator[dict]:
+    """
+    Lazily read the records of one section, one line at a time.
+
+    Returns:
+        Iterator[dict]: empty if the snapshot has no such section
+    """
+    manifest = read_manifest(snapshot_dir)
+    section_info = manifest.get("sections", {}).get(section)
+    if section_info is None:
+        return
+    with gzip.open(os.path.join(snapshot_dir, section_info.get("file")), "rt", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
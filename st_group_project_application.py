@@ -1,18 +1,20 @@
-from CheckmarxPythonSDK.CxOne.KeycloakAPI import (
-    get_group_hierarchy,
-)
+from concurrent.futures import ThreadPoolExecutor
 from CheckmarxPythonSDK.CxOne.AccessControlAPI import (
     get_groups,
 )
 from typing import List
 from CheckmarxPythonSDK.CxOne import (
     get_all_projects,
-    get_a_list_of_applications,
     get_sast_results_by_scan_id,
 )
+from http_client import configure_http_client
+from metrics import write_metrics
+from migration_config import config
+from snapshot import SnapshotWriter
+from tenant_catalog import get_all_applications, get_group_paths
 
 import logging
-import pickle
+
 # create logger
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
@@ -26,45 +28,51 @@ time_stamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
 __all__ = ["logger"]
 
 
-if __name__ == '__main__':
-    cxone_tenant_name = "coupangst"
-    logger.info("get all groups")
-    groups = get_groups(realm=cxone_tenant_name)
-    logger.info("get all projects")
-    projects = get_all_projects()
-    for project in projects:
-        project_name = project.name
-        project_assigned_group_ids = project.groups
-        group_names = []
-        for group_id in project_assigned_group_ids:
-            logger.info(f"project_name: {project_name}, group_id: {group_id}")
-            filtered_groups = list(filter(lambda r: r.id == group_id, groups))
-            if filtered_groups:
-                group_name = filtered_groups[0].name
-                group_names.append(group_name)
-        project.groups = group_names
-    logger.info("get all applications")
-    applications = get_a_list_of_applications(limit=100).applications
+def export_tenant(cxone_tenant_name: str, snapshot_dir: str):
+    """
+    Fetch groups, group hierarchy, projects and applications of the ST tenant concurrently and write them into the
+    snapshot. Group ids are resolved to full paths through one id -> path dict.
+    """
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        groups_future = executor.submit(get_groups, realm=cxone_tenant_name)
+        group_paths_future = executor.submit(get_group_paths, cxone_tenant_name)
+        projects_future = executor.submit(get_all_projects)
+        applications_future = executor.submit(get_all_applications)
 
-    data = {
-        "groups": [{"name": group.name} for group in groups],
-        "projects": [{
-            "criticality": project.criticality,
-            "groups": project.groups,
-            "mainBranch": project.mainBranch,
-            "name": project.name,
-            "origin": project.origin,
-            "repoUrl": project.repoUrl,
-            "tags": project.tags,
-        } for project in projects],
-        "applications": [{
-            "criticality": application.criticality,
-            "description": application.description,
-            "name": application.name,
-            "rules": [{"type": rule.type, "value": rule.value} for rule in application.rules],
-            "tags": application.tags,
-        } for application in applications],
-    }
+        group_paths = group_paths_future.result()
+        for group in groups_future.result():
+            group_paths.setdefault(group.id, group.name)
+        with SnapshotWriter(snapshot_dir) as snapshot:
+            snapshot.write_all("groups", ({"name": group_path} for group_path in sorted(group_paths.values())))
+            projects = projects_future.result()
+            logger.info(f"{len(projects)} projects")
+            for project in projects:
+                snapshot.write("projects", {
+                    "criticality": project.criticality,
+                    "groups": [
+                        group_paths.get(group_id) for group_id in project.groups or [] if group_id in group_paths
+                    ],
+                    "mainBranch": project.mainBranch,
+                    "name": project.name,
+                    "origin": project.origin,
+                    "repoUrl": project.repoUrl,
+                    "tags": project.tags,
+                })
+            applications = applications_future.result()
+            logger.info(f"{len(applications)} applications")
+            for application in applications:
+                snapshot.write("applications", {
+                    "criticality": application.criticality,
+                    "description": application.description,
+                    "name": application.name,
+                    "rules": [{"type": rule.type, "value": rule.value} for rule in application.rules or []],
+                    "tags": application.tags,
+                })
 
-    with open('data.pkl', 'wb') as file:
-        pickle.dump(data, file)
+
+if __name__ == '__main__':
+    response_cache = configure_http_client()
+    export_tenant(cxone_tenant_name="coupangst", snapshot_dir=config.get("snapshot_dir"))
+    if response_cache:
+        logger.info(response_cache.summary())
+    write_metrics()
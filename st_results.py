@@ -1,10 +1,23 @@
-import sqlite3
-from typing import List
+import os
+import sys
+from functools import partial
+from typing import Iterator, List
+from CheckmarxPythonSDK.CxOne.dto import SastResult
 from CheckmarxPythonSDK.CxOne import (
     get_all_projects,
-    get_branches,
-    get_a_list_of_scans,
-    get_sast_results_by_scan_id,
+)
+from http_client import configure_http_client
+from metrics import write_metrics
+from migration_config import config
+from result_store import ResultStore, merge_results_dbs, read_project_branches
+from scan_discovery import ProjectBranch, get_project_branch_units
+from sharding import (
+    get_shard_file, get_shard_files, is_in_shard, read_shard_units, run_shard_processes, write_shard_units
+)
+from state_journal import DONE, StateJournal
+from worker_pool import run_in_pool
+from sast_result_fetcher import (
+    get_all_sast_result_by_scan_id, get_sast_result_count, get_sast_results_page, iter_sast_result_pages
 )
 
 import logging
@@ -21,179 +34,155 @@ time_stamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
 
 __all__ = ["logger", "get_all_sast_result_by_scan_id"]
 
-
-def get_sast_result(project_name: str, branch: str, scan_id: str) -> List[dict]:
-    sast_results = get_all_sast_result_by_scan_id(scan_id)
-    report_content = []
-    for result in sast_results:
-        if result.state == "TO_VERIFY":
-            continue
-        report_content.append(
-            {
-                "id": None,
-                "project_name": project_name,
-                "branch": branch,
-                "cwe_id": result.cwe_id,
-                "language_name": result.language_name,
-                "query_group": result.query_group,
-                "query": result.query_name,
-                "source_file_name": result.nodes[0].fileName,
-                "source_line": result.nodes[0].line,
-                "source_column": result.nodes[0].column,
-                "source_name": result.nodes[0].fullName,
-                "dest_file_name": result.nodes[-1].fileName,
-                "dest_line": result.nodes[-1].line,
-                "dest_column": result.nodes[-1].column,
-                "dest_name": result.nodes[-1].fullName,
-                "result_state": result.state,
-                "result_severity": result.severity,
-                "comment": "",
-                "similarity_id": result.similarity_id,
-            }
-        )
-    return report_content
-
-
-def get_all_sast_result_by_scan_id(scan_id):
-    offset = 0
-    limit = 100
-    page = 1
-    sast_results_collection = get_sast_results_by_scan_id(
-        scan_id=scan_id, offset=offset, limit=limit,
-        sort=["+status", "+severity", "-queryname"]
-    )
-    total_count = int(sast_results_collection.get("totalCount"))
-    sast_results = sast_results_collection.get("results")
-    if total_count > limit:
-        while True:
-            offset = page * limit
-            if offset >= total_count:
-                break
-            sast_results_collection = get_sast_results_by_scan_id(
-                scan_id=scan_id, offset=offset, limit=limit,
-                sort=["+status", "+severity", "-queryname"]
+stage = "st_results"
+# every standard state but TO_VERIFY, the untriaged results are never downloaded
+triaged_states = ["NOT_EXPLOITABLE", "PROPOSED_NOT_EXPLOITABLE", "CONFIRMED", "URGENT"]
+
+
+def iter_triaged_result_pages(scan_id: str) -> Iterator[List[SastResult]]:
+    """
+    Pages of the results in st_result_states if it is set, else in the standard triaged states, as long as TO_VERIFY
+    and those states account for every result of the scan. A scan with results in custom states is fetched without a
+    state filter, so no triaged result is lost.
+
+    The count of the triaged results is the totalCount of their first page, which is kept as the first page of the
+    download, so the check costs one count request, and a second one only for a scan with TO_VERIFY results.
+    """
+    configured_states = [state.strip() for state in config.get("st_result_states").split(",") if state.strip()]
+    if configured_states:
+        return iter_sast_result_pages(scan_id, state=configured_states)
+    first_page = get_sast_results_page(scan_id, offset=0, state=triaged_states)
+    triaged_count = int(first_page.get("totalCount") or 0)
+    total_count = get_sast_result_count(scan_id)
+    if triaged_count == total_count or triaged_count + get_sast_result_count(scan_id, ["TO_VERIFY"]) == total_count:
+        return iter_sast_result_pages(scan_id, state=triaged_states, first_page=first_page)
+    logger.info(f"scan {scan_id}: results in custom states, fetch all states")
+    return iter_sast_result_pages(scan_id)
+
+
+def get_sast_result(project_name: str, branch: str, scan_id: str) -> Iterator[tuple]:
+    """
+    Yield one row tuple per triaged SAST result, in the row layout of ResultStore.
+
+    Only triaged results are requested from the server, pages are consumed while the following pages are still
+    downloading, so only the rows of the current page are kept in memory.
+    """
+    for page in iter_triaged_result_pages(scan_id):
+        for result in page:
+            if result.state == "TO_VERIFY":
+                continue
+            source_node = result.nodes[0]
+            dest_node = result.nodes[-1]
+            yield (
+                result.cwe_id,
+                result.language_name,
+                result.query_group,
+                result.query_name,
+                source_node.fileName,
+                source_node.line,
+                source_node.column,
+                source_node.fullName,
+                dest_node.fileName,
+                dest_node.line,
+                dest_node.column,
+                dest_node.fullName,
+                result.state,
+                result.severity,
+                result.similarity_id,
             )
-            page += 1
-            sast_results.extend(sast_results_collection.get("results"))
-    return sast_results
-
-
-sql_create_table = """
-CREATE TABLE IF NOT EXISTS results (
-id INTEGER PRIMARY KEY AUTOINCREMENT,
-project_name TEXT,
-branch TEXT,
-cwe_id INTEGER,
-language_name TEXT,
-query_group TEXT,
-query TEXT,
-source_file_name TEXT,
-source_line INTEGER,
-source_column INTEGER,
-source_name TEXT,
-dest_file_name TEXT,
-dest_line INTEGER,
-dest_column INTEGER,
-dest_name TEXT,
-result_state TEXT,
-result_severity TEXT,
-comment TEXT,
-similarity_id INTEGER
-);
-"""
-
-sql_create_index = "CREATE INDEX IF NOT EXISTS result_index ON results (project_name, branch)"
-
-sql_insert_table = """
-INSERT INTO results VALUES (
-:id,
-:project_name,
-:branch,
-:cwe_id,
-:language_name,
-:query_group,
-:query,
-:source_file_name,
-:source_line,
-:source_column,
-:source_name,
-:dest_file_name,
-:dest_line,
-:dest_column,
-:dest_name,
-:result_state,
-:result_severity,
-:comment,
-:similarity_id
-)
-"""
 
 
-def insert_into_db(result_data: List[dict]):
-    logger.info("insert data into database results.db")
-    con = sqlite3.connect("results.db")
-    logger.info(f"run sql: {sql_create_table}")
-    con.execute(sql_create_table)
-    logger.info(f"run sql: {sql_create_index}")
-    con.execute(sql_create_index)
+def process_project_branch(unit: ProjectBranch, result_store: ResultStore, state_journal: StateJournal) -> str:
+    project_id, project_name, branch, scan_id = unit
+    entry = state_journal.get(stage, project_name, branch)
+    refresh = entry is not None and entry.status == DONE
+    if refresh and (not config.get("incremental") or entry.scan_id == scan_id):
+        logger.info(f"project_name: {project_name}, branch: {branch} already exist in database! Skip!")
+        return "skipped"
+    if refresh:
+        logger.info(f"project_name: {project_name}, branch: {branch}, scan id: {entry.scan_id} -> {scan_id}, refresh")
+    else:
+        logger.info(f"project_name: {project_name}, branch: {branch}, scan id: {scan_id}")
+    state_journal.mark_started(stage, project_name, branch, scan_id)
+    write_rows = result_store.swap_rows if refresh else result_store.write_rows
     try:
-        with con:
-            con.executemany(sql_insert_table, result_data)
-    except sqlite3.IntegrityError:
-        print("couldn't add data twice")
-
-    # Connection object used as context manager only commits or rollbacks transactions,
-    # so the connection object should be closed manually
-    con.close()
-
-
-def get_project_branch_from_db():
-    result = set()
-    con = sqlite3.connect("results.db")
-    logger.info(f"run sql: {sql_create_table}")
-    con.execute(sql_create_table)
-    logger.info(f"run sql: {sql_create_index}")
-    con.execute(sql_create_index)
+        row_count = write_rows(project_name, branch, get_sast_result(project_name, branch, scan_id))
+    except Exception:
+        state_journal.mark_failed(stage, project_name, branch, scan_id)
+        raise
+    state_journal.mark_done(stage, project_name, branch, scan_id, row_count)
+    if not row_count:
+        logger.info(f"project_name: {project_name}, branch: {branch}, No scan result, Skip!")
+        return "no result"
+    logger.info(f"project_name: {project_name}, branch: {branch}, {row_count} results written")
+    return "refreshed" if refresh else "done"
+
+
+def run_shards(shard_count: int):
+    """
+    Extract with shard_count local processes, one per shard, then merge their shard databases into results_db.
+
+    The projects and the tenant wide scan index are read once here and every shard gets its own units file, instead
+    of each shard discovering the whole tenant again. Each shard writes its own metrics file.
+    """
+    configure_http_client()
+    db_file = config.get("results_db")
+    # seeded here and not by the shards, which would race for the empty journal
+    state_journal = StateJournal()
+    if state_journal.is_empty(stage):
+        imported = state_journal.import_done(stage, read_project_branches(db_file))
+        logger.info(f"imported {imported} project/branch pairs from {db_file} into the state journal")
+    state_journal.close()
+    units = get_project_branch_units(get_all_projects())
+    units_files = write_shard_units(units, f"{os.path.splitext(db_file)[0]}.units.json", shard_count)
     try:
-        with con:
-            for row in con.execute("SELECT project_name, branch FROM results"):
-                result.add((row[0], row[1]))
-    except sqlite3.IntegrityError:
-        print("couldn't add data twice")
-    con.close()
-    return list(result)
-
-
-if __name__ == '__main__':
-    projects = get_all_projects()
-    projects_branches_in_db = get_project_branch_from_db()
-    for project in projects:
-        project_id = project.id
-        project_name = project.name
-        if project_name in ["CxPSEMEA-Query Migration Project"]:
-            continue
-        branches = get_branches(limit=2048, project_id=project_id)
-        if not branches:
-            continue
-        branches_to_be_search = []
-        for branch in branches:
-            if branch in ["master", "main", "release", "rc", "develop", "stage"]:
-                branches_to_be_search.append(branch)
-        for branch in branches_to_be_search:
-            logger.info(f"project_name: {project_name}, branch: {branch}")
-            filtered_pb = list(filter(lambda r: r[0] == project_name and r[1] == branch, projects_branches_in_db))
-            if filtered_pb:
-                logger.info(f"branch already exist in database! Skip!")
-                continue
-            logger.info("get last scan")
-            scans_collection = get_a_list_of_scans(limit=1, project_id=project_id, branch=branch, sort=["-created_at"])
-            if not scans_collection.scans:
-                continue
-            scan_id = scans_collection.scans[0].id
-            logger.info(f"scan id: {scan_id}")
-            scan_result = get_sast_result(project_name, branch, scan_id)
-            logger.info(f"get last scan result")
-            if not scan_result:
-                logger.info("No scan result, Skip!")
-                continue
-            insert_into_db(scan_result)
+        exit_codes = run_shard_processes(
+            __file__, shard_count, [["--migration_shard_units_file", units_file] for units_file in units_files]
+        )
+    finally:
+        for units_file in units_files:
+            os.remove(units_file)
+    finding_count = merge_results_dbs(db_file, get_shard_files(db_file, shard_count))
+    logger.info(f"merged {shard_count} shards into {db_file}, {finding_count} findings")
+    write_metrics()
+    if any(exit_codes):
+        sys.exit(1)
+
+
+if __name__ == '__main__' and config.get("shard_count") > 1 and config.get("shard_index") < 0:
+    run_shards(config.get("shard_count"))
+elif __name__ == '__main__':
+    response_cache = configure_http_client()
+    shard_index, shard_count = config.get("shard_index"), config.get("shard_count")
+    db_file = get_shard_file(config.get("results_db"), shard_index, shard_count)
+    result_store = ResultStore(db_file=db_file)
+    state_journal = StateJournal()
+    if state_journal.is_empty(stage):
+        seed_db_file, project_branches = db_file, result_store.get_project_branches()
+        if not project_branches and db_file != config.get("results_db"):
+            # the first sharded run after an unsharded one, the pairs of this shard in results.db are done
+            seed_db_file = config.get("results_db")
+            project_branches = {
+                (project_name, branch) for project_name, branch in read_project_branches(seed_db_file)
+                if is_in_shard(project_name, shard_index, shard_count)
+            }
+        imported = state_journal.import_done(stage, project_branches)
+        logger.info(f"imported {imported} project/branch pairs from {seed_db_file} into the state journal")
+    workers = config.get("workers")
+    if config.get("shard_units_file"):
+        units = read_shard_units(config.get("shard_units_file"))
+    else:
+        # a shard started on its own machine discovers the tenant itself and keeps the projects of its shard
+        projects = [project for project in get_all_projects() if is_in_shard(project.name, shard_index, shard_count)]
+        units = get_project_branch_units(projects)
+    run_in_pool(
+        units,
+        partial(process_project_branch, result_store=result_store, state_journal=state_journal),
+        workers=workers,
+        description=stage,
+    )
+    result_store.close()
+    state_journal.close()
+    if response_cache:
+        logger.info(response_cache.summary())
+    write_metrics(get_shard_file(config.get("metrics_file"), shard_index, shard_count))
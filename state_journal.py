@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+from metrics import metrics
+from migration_config import config
+
+import logging
+
+logger = logging.getLogger("main")
+time_stamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+__all__ = ["StateJournal", "JournalEntry", "STARTED", "DONE", "FAILED"]
+
+STARTED = "started"
+DONE = "done"
+FAILED = "failed"
+
+JournalEntry = namedtuple(
+    "JournalEntry", ["stage", "project_name", "branch", "scan_id", "status", "row_count", "started_at", "updated_at"]
+)
+
+sql_create_table = """
+CREATE TABLE IF NOT EXISTS journal (
+stage TEXT NOT NULL,
+project_name TEXT NOT NULL,
+branch TEXT NOT NULL,
+scan_id TEXT,
+status TEXT NOT NULL,
+row_count INTEGER,
+started_at TEXT,
+updated_at TEXT,
+PRIMARY KEY (stage, project_name, branch)
+) WITHOUT ROWID
+"""
+
+sql_upsert = """
+INSERT INTO journal VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (stage, project_name, branch) DO UPDATE SET
+scan_id = excluded.scan_id,
+status = excluded.status,
+row_count = excluded.row_count,
+started_at = COALESCE(excluded.started_at, journal.started_at),
+updated_at = excluded.updated_at
+"""
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).strftime(time_stamp_format)
+
+
+class StateJournal:
+    """
+    Resume state of st_results and mt_results, one row per (stage, project, branch).
+
+    Every update is a single indexed upsert, lookups hit the primary key, so neither grows with the size of the run.
+    """
+
+    def __init__(self, db_file: str = None):
+        self.db_file = db_file or config.get("state_db")
+        self.connection = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(sql_create_table)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, stage: str, project_name: str, branch: str) -> Optional[JournalEntry]:
+        with self.lock, metrics.timer("db", "journal get"):
+            row = self.connection.execute(
+                "SELECT * FROM journal WHERE stage = ? AND project_name = ? AND branch = ?",
+                (stage, project_name, branch)
+            ).fetchone()
+        return JournalEntry(*row) if row else None
+
+    def is_done(self, stage: str, project_name: str, branch: str) -> bool:
+        entry = self.get(stage, project_name, branch)
+        return entry is not None and entry.status == DONE
+
+    def is_empty(self, stage: str) -> bool:
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM journal WHERE stage = ? LIMIT 1", (stage,)).fetchone()
+        return row is None
+
+    def mark_started(self, stage: str, project_name: str, branch: str, scan_id: str = None):
+        time_stamp = now()
+        self._upsert((stage, project_name, branch, scan_id, STARTED, None, time_stamp, time_stamp))
+
+    def mark_done(self, stage: str, project_name: str, branch: str, scan_id: str = None, row_count: int = None):
+        self._upsert((stage, project_name, branch, scan_id, DONE, row_count, None, now()))
+
+    def mark_failed(self, stage: str, project_name: str, branch: str, scan_id: str = None):
+        self._upsert((stage, project_name, branch, scan_id, FAILED, None, None, now()))
+
+    def import_done(self, stage: str, project_branches: Iterable[Tuple[str, str]]) -> int:
+        """
+        Record project/branch pairs processed before the journal existed, in one transaction.
+
+        Returns:
+            int: number of imported pairs
+        """
+        time_stamp = now()
+        rows = [(stage, project_name, branch, None, DONE, None, None, time_stamp)
+                for project_name, branch in project_branches]
+        with self.lock, metrics.timer("db", "journal import"):
+            with self.connection:
+                self.connection.executemany(sql_upsert, rows)
+        return len(rows)
+
+    def _upsert(self, row: tuple):
+        with self.lock, metrics.timer("db", "journal upsert"):
+            with self.connection:
+                self.connection.execute(sql_upsert, row)
@@ -0,0 +1,110 @@
+import threading
+from typing import Dict, Iterable, List, Optional
+from CheckmarxPythonSDK.CxOne import (
+    get_a_list_of_applications,
+    get_all_projects,
+)
+from CheckmarxPythonSDK.CxOne.dto import Application, Project
+from CheckmarxPythonSDK.CxOne.KeycloakAPI import get_group_hierarchy
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["get_all_applications", "get_group_paths", "ApplicationCatalog", "ProjectCatalog"]
+
+application_page_size = 100
+group_page_size = 100
+
+
+def get_all_applications() -> List[Application]:
+    applications = []
+    offset = 0
+    application_collection = get_a_list_of_applications(offset=offset, limit=application_page_size)
+    total_count = int(application_collection.totalCount or 0)
+    applications.extend(application_collection.applications)
+    while True:
+        offset += application_page_size
+        if offset >= total_count:
+            break
+        application_collection = get_a_list_of_applications(offset=offset, limit=application_page_size)
+        applications.extend(application_collection.applications)
+    return applications
+
+
+def get_group_paths(realm: str) -> Dict[str, str]:
+    """
+    Page through the keycloak group hierarchy of a realm and flatten it.
+
+    Returns:
+        dict: group id -> full group path without the leading slash, e.g. "parent/child"
+    """
+    group_paths = {}
+
+    def add_groups(groups, parent_path):
+        for group in groups:
+            group_path = (group.path or "").lstrip("/") or "/".join(filter(None, [parent_path, group.name]))
+            group_paths[group.id] = group_path
+            add_groups(group.subGroups or [], group_path)
+
+    first = 0
+    while True:
+        groups = get_group_hierarchy(
+            realm=realm, brief_representation=False, first=str(first), max_result_size=group_page_size
+        )
+        add_groups(groups, "")
+        if len(groups) < group_page_size:
+            break
+        first += group_page_size
+    logger.info(f"group hierarchy loaded, {len(group_paths)} groups")
+    return group_paths
+
+
+class ApplicationCatalog:
+    """
+    Name -> application of every application in a tenant, read once and updated after each create.
+    """
+
+    def __init__(self, applications: Iterable = None):
+        if applications is None:
+            applications = get_all_applications()
+        self.lock = threading.Lock()
+        self.applications = {application.name: application for application in applications}
+        logger.info(f"application catalog loaded, {len(self.applications)} applications")
+
+    def __contains__(self, application_name: str) -> bool:
+        with self.lock:
+            return application_name in self.applications
+
+    def get(self, application_name: str) -> Optional[Application]:
+        with self.lock:
+            return self.applications.get(application_name)
+
+    def add(self, application):
+        with self.lock:
+            self.applications[application.name] = application
+
+
+class ProjectCatalog:
+    """
+    Name -> project of every project in a tenant, from one get_all_projects snapshot, updated after each create.
+    """
+
+    def __init__(self, projects: Iterable[Project] = None):
+        if projects is None:
+            projects = get_all_projects()
+        self.lock = threading.Lock()
+        self.projects = {project.name: project for project in projects}
+        logger.info(f"project catalog loaded, {len(self.projects)} projects")
+
+    def __contains__(self, project_name: str) -> bool:
+        with self.lock:
+            return project_name in self.projects
+
+    def get(self, project_name: str) -> Optional[Project]:
+        with self.lock:
+            return self.projects.get(project_name)
+
+    def add(self, project: Project):
+        with self.lock:
+            self.projects[project.name] = project
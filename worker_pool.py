@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable
+
+import logging
+
+logger = logging.getLogger("main")
+
+__all__ = ["Progress", "run_in_pool", "FAILED"]
+
+FAILED = "failed"
+
+
+class Progress:
+    """
+    Thread safe outcome counters of a worker pool run.
+    """
+
+    def __init__(self, description: str, total: int):
+        self.description = description
+        self.total = total
+        self.finished = 0
+        self.outcomes = Counter()
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+
+    def add(self, outcome: str):
+        with self.lock:
+            self.finished += 1
+            self.outcomes[outcome] += 1
+            message = self.summary()
+        logger.info(message)
+
+    def summary(self) -> str:
+        outcomes = ", ".join(f"{outcome}: {count}" for outcome, count in sorted(self.outcomes.items()))
+        elapsed = time.monotonic() - self.started_at
+        rate = self.finished / elapsed if elapsed else 0.0
+        eta = f"{(self.total - self.finished) / rate:.0f}s" if rate else "unknown"
+        return (
+            f"{self.description} progress: {self.finished}/{self.total} ({outcomes}), "
+            f"{rate * 60:.1f}/min, ETA {eta}"
+        )
+
+
+def run_in_pool(items: Iterable, function: Callable, workers: int, description: str) -> Progress:
+    """
+    Run function on every item with at most workers threads.
+
+    function returns an outcome label that is counted in the progress. An exception only fails its own item, it is
+    logged and counted as "failed".
+
+    Returns:
+        Progress
+    """
+    items = list(items)
+    progress = Progress(description=description, total=len(items))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(function, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                outcome = future.result()
+            except Exception:
+                logger.exception(f"{description} failed for {futures[future]}")
+                outcome = FAILED
+            progress.add(outcome)
+    return progress